@@ -1,4 +1,5 @@
-from services.api_gateway.main import app
+from services.api_gateway.main import app, startup
 
 if __name__ == '__main__':
+    startup()
     app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
@@ -0,0 +1,17 @@
+import os
+import uvicorn
+
+# Production launcher for the ASGI app; run_demo.py keeps the Flask debug server for local use
+# LLM calls use the async client, but queries still run the synchronous DB/FAISS pipeline on threads,
+# so each worker process handles at most ASGI_THREAD_LIMIT of them at once (see
+# services/api_gateway/asgi.py); scale with API_WORKERS
+if __name__ == '__main__':
+    uvicorn.run(
+        "services.api_gateway.asgi:app",
+        host=os.getenv("API_HOST", "0.0.0.0"),
+        port=int(os.getenv("API_PORT", "5002")),
+        workers=int(os.getenv("API_WORKERS", str(os.cpu_count() or 1))),
+        backlog=int(os.getenv("API_BACKLOG", "2048")),
+        timeout_keep_alive=int(os.getenv("API_KEEP_ALIVE_SECONDS", "5")),
+        log_level=os.getenv("API_LOG_LEVEL", "info")
+    )
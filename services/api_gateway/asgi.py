@@ -0,0 +1,180 @@
+import os
+import asyncio
+import shutil
+import logging
+import functools
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Optional
+from anyio import CapacityLimiter, to_thread
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from ..genai.llm_config import start_warm_up
+from ..genai.streaming import set_llm_loop
+from ..crm_api.hubspot_adapter import close_async_client
+from ..session.message_writer import message_writer
+from ..session.schema import ensure_schema
+from ..session.session_manager import preload_session_contexts
+from . import handlers
+
+logger = logging.getLogger(__name__)
+
+# LLM calls run on the event loop through the async OpenAI client (ainvoke/astream), but the DB and
+# FAISS steps around them are synchronous and the pipeline waits for each LLM reply on its thread.
+# So this is still the real per-process concurrency limit: at most this many requests (other than
+# open streams, which run on QUERY_STREAM_MAX_WORKERS) do work at once, and stages that hold a MySQL
+# connection are further capped by DB_POOL_SIZE. Requests beyond it wait on the event loop, not on a
+# thread. A deployment serves API_WORKERS times this.
+ASGI_THREAD_LIMIT = int(os.getenv("ASGI_THREAD_LIMIT", "256"))
+
+_limiter: Optional[CapacityLimiter] = None
+
+async def _run_sync(fn: Callable[..., Any], *args: Any) -> Any:
+    return await to_thread.run_sync(functools.partial(fn, *args), limiter=_limiter)
+
+def _respond(result: handlers.JsonResponse) -> JSONResponse:
+    payload, status = result
+    return JSONResponse(payload, status_code=status)
+
+async def _json_body(request: Request) -> Any:
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def start_session(request: Request) -> JSONResponse:
+    return _respond(await _run_sync(handlers.start_session, await _json_body(request)))
+
+async def upload_csv(request: Request) -> JSONResponse:
+    """Upload and process CSV file."""
+    form = await request.form()
+    upload = form.get('file')
+    if not isinstance(upload, UploadFile):
+        upload = None
+
+    def save_file(file_path: str) -> None:
+        with open(file_path, "wb") as f:
+            shutil.copyfileobj(upload.file, f)
+
+    try:
+        return _respond(await _run_sync(
+            handlers.upload_csv,
+            form.get('session_id'),
+            upload.filename if upload is not None else None,
+            save_file
+        ))
+    finally:
+        await form.close()
+
+async def upload_csv_status(request: Request) -> JSONResponse:
+    """Report progress of a CSV ingestion job."""
+    return _respond(await _run_sync(handlers.upload_csv_status, request.path_params["job_id"]))
+
+async def query_data(request: Request) -> JSONResponse:
+    return _respond(await _run_sync(handlers.query, await _json_body(request)))
+
+async def _drain_stream(start: handlers.StreamStart) -> AsyncIterator[str]:
+    # The pipeline thread hands events to the loop, so an open stream holds no worker thread
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue[Any]" = asyncio.Queue()
+
+    def put(event: Any) -> None:
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            # Loop closed during shutdown; the pipeline still finishes and saves the turn
+            pass
+
+    start(put)
+    while True:
+        try:
+            event = await asyncio.wait_for(events.get(), handlers.STREAM_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            yield handlers.STREAM_KEEP_ALIVE
+            continue
+        if event is handlers.STREAM_END:
+            return
+        yield event
+
+async def query_stream(request: Request) -> Response:
+    """Stream the answer to a query as Server-Sent Events."""
+    start, error = await _run_sync(handlers.query_stream, await _json_body(request))
+    if error:
+        return _respond(error)
+    return StreamingResponse(_drain_stream(start), media_type="text/event-stream", headers=handlers.SSE_HEADERS)
+
+async def query_batch(request: Request) -> JSONResponse:
+    """Process many queries in one request."""
+    return _respond(await _run_sync(handlers.query_batch, await _json_body(request)))
+
+async def get_chat_history_endpoint(request: Request) -> JSONResponse:
+    """Retrieve chat history for a session."""
+    return _respond(await _run_sync(
+        handlers.chat_history,
+        request.path_params["session_id"],
+        request.query_params.get('limit'),
+        request.query_params.get('before')
+    ))
+
+async def clear_session(request: Request) -> JSONResponse:
+    """Clear chat history for a session."""
+    return _respond(await _run_sync(handlers.clear_session, await _json_body(request)))
+
+async def health_check(request: Request) -> JSONResponse:
+    """Health check endpoint."""
+    return _respond(await _run_sync(handlers.health_check))
+
+async def metrics(request: Request) -> JSONResponse:
+    """Runtime metrics endpoint."""
+    payload, status = handlers.metrics()
+    if status == 200 and _limiter is not None:
+        payload["asgi_threads"] = {
+            "limit": _limiter.total_tokens,
+            "busy": _limiter.borrowed_tokens,
+            "waiting": _limiter.statistics().tasks_waiting
+        }
+    return JSONResponse(payload, status_code=status)
+
+async def create_ticket_endpoint(request: Request) -> JSONResponse:
+    """Create a HubSpot ticket over the async HTTP client."""
+    return _respond(await handlers.create_ticket_async(await _json_body(request)))
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    global _limiter
+    _limiter = CapacityLimiter(ASGI_THREAD_LIMIT)
+    set_llm_loop(asyncio.get_running_loop())
+    await to_thread.run_sync(ensure_schema)
+    # Restore live conversations' context so a restart does not re-ask users for it
+    await to_thread.run_sync(preload_session_contexts)
+    # Build the LLM client and FAQ index in the background; /health reports "warming" until done
+    start_warm_up()
+    try:
+        yield
+    finally:
+        set_llm_loop(None)
+        await close_async_client()
+        # Drain queued chat messages before the worker exits
+        await to_thread.run_sync(message_writer.close)
+
+app = Starlette(
+    routes=[
+        Route('/start_session', start_session, methods=['POST']),
+        Route('/upload_csv', upload_csv, methods=['POST']),
+        Route('/upload_csv/{job_id}', upload_csv_status, methods=['GET']),
+        Route('/query', query_data, methods=['POST']),
+        Route('/query/stream', query_stream, methods=['POST']),
+        Route('/query/batch', query_batch, methods=['POST']),
+        Route('/chat_history/{session_id}', get_chat_history_endpoint, methods=['GET']),
+        Route('/clear_session', clear_session, methods=['POST']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/api/create-ticket', create_ticket_endpoint, methods=['POST'])
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan
+)
@@ -0,0 +1,498 @@
+import logging
+import re
+import os
+import json
+import uuid
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from werkzeug.utils import secure_filename
+from ..genai.intent_classifier import intent_classifier, is_logistics_query, get_knn_stats
+from ..genai.intent_router import get_router_stats, ORDER_INTENTS
+from ..genai.embedding_cache import get_embeddings, get_embedding_cache_stats
+from ..genai.llm_config import get_readiness
+from ..genai.response_cache import response_cache
+from ..genai.turn_stages import stage_scope, cancel_stages, get_stage_stats
+from ..genai.streaming import token_stream
+from ..genai.agent import chat_with_csv, chat_with_mysql, is_continuing_query,handle_reschedule_delivery, handle_address_change, handle_general_query, handle_capabilities_query, handle_small_talks, handle_frustration, handle_vip
+from ..session.session_manager import create_session, retrieve_chat_history, mark_session_as_deleted, save_chat_message, load_session_snapshot, load_session_snapshots, session_context_cache, session_scope, prefetch_turn_stages, SessionSnapshot, fetch_chat_page, HISTORY_PAGE_SIZE
+from ..data_processing.csv_processor import UPLOAD_FOLDER
+from ..data_processing.index_registry import index_registry
+from ..data_processing.ingestion_jobs import ingestion_jobs, IngestionQueueFull
+from ..database.db_utils import get_db_connection, get_pool_stats, MYSQL_QUERY_CONFIG
+from ..database.order_cache import order_cache
+from ..crm_api.hubspot_adapter import create_hubspot_ticket, create_hubspot_ticket_async
+from ..session.session_cache import session_validity
+from ..session.message_writer import message_writer
+from ..session.summarizer import schedule_summary_update
+from .models.genai_query import QueryRequest, SessionRequest, ClearSessionRequest, TicketRequest, BatchQueryRequest
+
+logger = logging.getLogger(__name__)
+
+# Framework-neutral endpoint bodies shared by the Flask app (main.py) and the ASGI app (asgi.py)
+JsonResponse = Tuple[Dict[str, Any], int]
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+# Streamed queries run the pipeline on their own pool while the response generator drains tokens
+QUERY_STREAM_MAX_WORKERS = int(os.getenv("QUERY_STREAM_MAX_WORKERS", "64"))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "10"))
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+STREAM_KEEP_ALIVE = ": keep-alive\n\n"
+# Passed to a stream's sink after its last event
+STREAM_END = object()
+StreamSink = Callable[[Any], None]
+StreamStart = Callable[[StreamSink], None]
+_stream_executor = ThreadPoolExecutor(max_workers=QUERY_STREAM_MAX_WORKERS, thread_name_prefix="query-stream")
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# Sessions processed in parallel per batch; keeps a backfill from starving the LLM rate limit
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+def start_session(data: Any) -> JsonResponse:
+    try:
+        session_request = SessionRequest(**data)
+        session_id = create_session(session_request.client_id)
+        return {"status": "success", "session_id": session_id}, 201
+    except Exception as e:
+        logger.error(f"Session creation error: {e}")
+        return {"error": str(e), "error_code": "SESSION_CREATION_FAILED"}, 500
+
+def upload_csv(session_id: Optional[str], filename: Optional[str], save_file: Callable[[str], None]) -> JsonResponse:
+    """Upload and process CSV file; filename is None when the request has no file part."""
+    if not session_id:
+        logger.warning("Missing session ID in CSV upload")
+        return {"error": "Session ID is required", "error_code": "MISSING_SESSION_ID"}, 400
+
+    if filename is None:
+        logger.warning("No file part in CSV upload request")
+        return {"error": "No file part in the request", "error_code": "NO_FILE"}, 400
+
+    if filename == '':
+        logger.warning("No file selected in CSV upload")
+        return {"error": "No file selected", "error_code": "NO_FILE_SELECTED"}, 400
+
+    if filename.lower().endswith('.csv'):
+        filename = secure_filename(filename)
+        file_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{filename}")
+        try:
+            save_file(file_path)
+            job = ingestion_jobs.submit(file_path, filename)
+            logger.info(f"Queued CSV for processing: {filename} (job {job.job_id})")
+            return {
+                "message": "CSV accepted for processing",
+                "job_id": job.job_id,
+                "status": job.status
+            }, 202
+        except IngestionQueueFull as e:
+            logger.warning(f"CSV ingestion queue full: {e}")
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return {"error": "Too many CSV uploads in progress, please retry later", "error_code": "INGESTION_BUSY"}, 429
+        except Exception as e:
+            logger.error(f"CSV processing error: {e}")
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return {"error": str(e), "error_code": "PROCESSING_FAILED"}, 500
+    else:
+        logger.warning("Invalid file format in CSV upload")
+        return {"error": "Please upload a CSV file", "error_code": "INVALID_FILE"}, 400
+
+def upload_csv_status(job_id: str) -> JsonResponse:
+    """Report progress of a CSV ingestion job."""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return {"error": "Ingestion job not found", "error_code": "JOB_NOT_FOUND"}, 404
+    return job.to_dict(), 200
+
+def run_query_pipeline(session_id: str, user_input: str) -> Dict[str, Any]:
+    """Classify a validated query and dispatch it to the matching handler."""
+    save_chat_message(session_id, 'user', user_input)
+    with stage_scope():
+        # Order/email extraction overlaps intent classification when PARALLEL_STAGES is on
+        prefetch_turn_stages(session_id, user_input)
+        intent = intent_classifier(user_input, session_id)
+        logger.debug(f"Classified intent: {intent} for query: {user_input}")
+        if intent not in ORDER_INTENTS:
+            cancel_stages("order_id")
+
+        # if not is_logistics_query(user_input):
+        #     result = {"response": "I'm sorry, I can only assist with transport and logistics queries. Please ask about orders or shipments."}
+        # else:
+        is_continuing_query(session_id, intent, user_input)
+
+        chat_history = retrieve_chat_history(session_id)["messages"]
+        if intent == "csv":
+            result = chat_with_csv(session_id, user_input)
+        elif intent == "mysql":
+            result = chat_with_mysql(session_id, user_input, chat_history)
+        elif intent == "reschedule_delivery":
+            result = handle_reschedule_delivery(session_id, user_input, chat_history)
+        elif intent == "address_change":
+            result = handle_address_change(session_id, user_input, chat_history)
+        elif intent == "general":
+            result = handle_general_query(session_id, user_input)
+        elif intent == "capabilities":
+            result = handle_capabilities_query(session_id, user_input)
+        elif intent == "small_talks":
+            result = handle_small_talks(session_id, user_input)
+        elif intent == "frustration":
+            result = handle_frustration(session_id, user_input)
+        elif intent == "vip":
+            result = handle_vip(session_id, user_input)
+        else:
+            logger.warning(f"Unknown intent: {intent}")
+            result = {"response": "I'm not sure how to handle that request. Please ask about orders or logistics."}
+    # Off the request path: folds older turns into the session summary every SUMMARY_EVERY_TURNS turns
+    schedule_summary_update(session_id)
+    return result
+
+def _load_query(data: Any) -> Tuple[Optional[QueryRequest], Optional[SessionSnapshot], Optional[JsonResponse]]:
+    """Validate a query payload and load its session; returns an error response instead when invalid."""
+    query_request = QueryRequest(**data)
+    session_id = query_request.session_id
+
+    if session_validity.rejects(session_id, query_request.client_id):
+        logger.warning(f"Invalid client_id for session: {session_id} (cached)")
+        return None, None, ({"error": "Invalid session or client ID", "error_code": "INVALID_SESSION"}, 400)
+
+    try:
+        snapshot = load_session_snapshot(session_id)
+    except Exception as e:
+        logger.error(f"Session snapshot load failed: {e}")
+        return None, None, ({"error": "Database connection failed", "error_code": "DB_CONNECTION_FAILED"}, 500)
+    if not snapshot or snapshot.client_id != query_request.client_id:
+        logger.warning(f"Invalid client_id for session: {session_id}")
+        return None, None, ({"error": "Invalid session or client ID", "error_code": "INVALID_SESSION"}, 400)
+
+    if not query_request.query.strip():
+        logger.warning("Empty query received")
+        return None, None, ({"error": "Query cannot be empty", "error_code": "EMPTY_QUERY"}, 400)
+
+    return query_request, snapshot, None
+
+def _query_response(result: Dict[str, Any], order_id: Optional[str]) -> JsonResponse:
+    if "error" in result:
+        logger.error(f"Query processing error: {result['error']}")
+        return {"error": result["error"], "error_code": result["error_code"]}, 500
+
+    response = {"response": result["response"]}
+    if "sql_query" in result:
+        response.update({
+            "sql_query": result["sql_query"],
+            "sql_response": result["sql_response"]
+        })
+    if order_id:
+        response["order_id"] = order_id
+    return response, 200
+
+def query(data: Any) -> JsonResponse:
+    try:
+        query_request, snapshot, error = _load_query(data)
+        if error:
+            return error
+        session_id = query_request.session_id
+        user_input = query_request.query.strip()
+
+        logger.info(f"Processing query: '{user_input}' for session: {session_id}")
+
+        with session_scope(snapshot):
+            result = run_query_pipeline(session_id, user_input)
+
+        response = _query_response(result, query_request.order_id)
+        if response[1] == 200:
+            logger.info(f"Query processed successfully for session {session_id}")
+        return response
+    except Exception as e:
+        logger.error(f"Unexpected error in query processing: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return {"error": str(e), "error_code": "UNEXPECTED_ERROR"}, 500
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _run_stream(query_request: QueryRequest, snapshot: SessionSnapshot, put: StreamSink) -> None:
+    session_id = query_request.session_id
+    user_input = query_request.query.strip()
+    try:
+        try:
+            with token_stream(lambda token: put(_sse("token", {"token": token}))), session_scope(snapshot):
+                result = run_query_pipeline(session_id, user_input)
+            payload, status = _query_response(result, query_request.order_id)
+        except Exception as e:
+            logger.error(f"Unexpected error in streamed query processing: {str(e)}")
+            payload, status = {"error": str(e), "error_code": "UNEXPECTED_ERROR"}, 500
+        if status == 200:
+            logger.info(f"Streamed query processed successfully for session {session_id}")
+        put(_sse("done" if status == 200 else "error", payload))
+    finally:
+        put(STREAM_END)
+
+def iter_stream(start: StreamStart) -> Iterator[str]:
+    """Start a stream returned by query_stream and yield its events, with keep-alives; for WSGI servers."""
+    events: "queue.Queue[Any]" = queue.Queue()
+    start(events.put)
+    while True:
+        try:
+            event = events.get(timeout=STREAM_HEARTBEAT_SECONDS)
+        except queue.Empty:
+            yield STREAM_KEEP_ALIVE
+            continue
+        if event is STREAM_END:
+            return
+        yield event
+
+def query_stream(data: Any) -> Tuple[Optional[StreamStart], Optional[JsonResponse]]:
+    """Validate a query and return a function that starts a Server-Sent Events stream of its answer, or an error response.
+
+    start(put) runs the query on the stream pool and passes put each event as a formatted SSE
+    string, then STREAM_END; put is called from the pool thread, so the caller supplies the queue
+    (see iter_stream for WSGI; the ASGI app feeds an asyncio.Queue). The pipeline keeps running if
+    the client disconnects, so the turn is still persisted.
+
+    The stream sends "token" events as the answer is generated, then a single "done" event with
+    the complete response (plus sql_query/sql_response when present) or an "error" event. The
+    "done" payload is authoritative: handlers that fall back to a canned reply after partial
+    output report the reply actually saved to the chat history there.
+    """
+    try:
+        query_request, snapshot, error = _load_query(data)
+        if error:
+            return None, error
+        logger.info(f"Streaming query: '{query_request.query.strip()}' for session: {query_request.session_id}")
+
+        def start(put: StreamSink) -> None:
+            _stream_executor.submit(_run_stream, query_request, snapshot, put)
+        return start, None
+    except Exception as e:
+        logger.error(f"Unexpected error in query processing: {str(e)}")
+        return None, ({"error": str(e), "error_code": "UNEXPECTED_ERROR"}, 500)
+
+def _run_batch_session(items: List[Tuple[int, QueryRequest]], snapshot: SessionSnapshot) -> List[Tuple[int, JsonResponse]]:
+    # One session's items run in submission order so each sees the previous turn's context
+    results = []
+    for index, query_request in items:
+        try:
+            with session_scope(snapshot):
+                result = run_query_pipeline(query_request.session_id, query_request.query.strip())
+            results.append((index, _query_response(result, query_request.order_id)))
+        except Exception as e:
+            logger.error(f"Unexpected error in batch item {index}: {str(e)}")
+            results.append((index, ({"error": str(e), "error_code": "UNEXPECTED_ERROR"}, 500)))
+    return results
+
+def query_batch(data: Any) -> JsonResponse:
+    """Process many (session_id, client_id, query) items and return per-item results in input order.
+
+    Sessions are loaded in grouped reads and the queries are embedded in one batch up front.
+    Different sessions run in parallel (up to BATCH_MAX_CONCURRENCY); items of the same session
+    run sequentially in the order given.
+    """
+    try:
+        batch_request = BatchQueryRequest(**data)
+        if len(batch_request.items) > BATCH_MAX_ITEMS:
+            return {"error": f"A batch may contain at most {BATCH_MAX_ITEMS} items", "error_code": "BATCH_TOO_LARGE"}, 400
+
+        results: List[Optional[JsonResponse]] = [None] * len(batch_request.items)
+        valid: List[Tuple[int, QueryRequest]] = []
+        for index, item in enumerate(batch_request.items):
+            try:
+                query_request = QueryRequest.model_validate(item)
+            except Exception as e:
+                results[index] = ({"error": str(e), "error_code": "INVALID_ITEM"}, 400)
+                continue
+            if not query_request.query.strip():
+                results[index] = ({"error": "Query cannot be empty", "error_code": "EMPTY_QUERY"}, 400)
+                continue
+            if session_validity.rejects(query_request.session_id, query_request.client_id):
+                results[index] = ({"error": "Invalid session or client ID", "error_code": "INVALID_SESSION"}, 400)
+                continue
+            valid.append((index, query_request))
+
+        try:
+            snapshots = load_session_snapshots(query_request.session_id for _, query_request in valid)
+        except Exception as e:
+            logger.error(f"Batch session snapshot load failed: {e}")
+            return {"error": "Database connection failed", "error_code": "DB_CONNECTION_FAILED"}, 500
+
+        by_session: Dict[str, List[Tuple[int, QueryRequest]]] = {}
+        for index, query_request in valid:
+            snapshot = snapshots.get(query_request.session_id)
+            if not snapshot or snapshot.client_id != query_request.client_id:
+                results[index] = ({"error": "Invalid session or client ID", "error_code": "INVALID_SESSION"}, 400)
+                continue
+            by_session.setdefault(query_request.session_id, []).append((index, query_request))
+
+        queries = list(dict.fromkeys(
+            query_request.query.strip() for items in by_session.values() for _, query_request in items
+        ))
+        if queries:
+            try:
+                # Warms the embedding cache for the FAQ similarity check and kNN intent lookup
+                get_embeddings().embed_documents(queries)
+            except Exception as e:
+                logger.warning(f"Batch query embedding failed, items will embed individually: {e}")
+
+        logger.info(f"Processing batch of {len(batch_request.items)} queries across {len(by_session)} sessions")
+        with ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="query-batch") as executor:
+            futures = [
+                executor.submit(_run_batch_session, items, snapshots[session_id])
+                for session_id, items in by_session.items()
+            ]
+            for future in futures:
+                for index, response in future.result():
+                    results[index] = response
+
+        return {
+            "results": [
+                {"index": index, "status": status, **payload}
+                for index, (payload, status) in enumerate(results)
+            ]
+        }, 200
+    except Exception as e:
+        logger.error(f"Unexpected error in batch query processing: {str(e)}")
+        return {"error": str(e), "error_code": "UNEXPECTED_ERROR"}, 500
+
+def chat_history(session_id: str, limit: Optional[str] = None, before: Optional[str] = None) -> JsonResponse:
+    """Retrieve one page of chat history for a session, newest page first."""
+    try:
+        page_size = int(limit) if limit else HISTORY_PAGE_SIZE
+        if page_size <= 0:
+            raise ValueError
+    except ValueError:
+        return {"error": "limit must be a positive integer", "error_code": "INVALID_LIMIT"}, 400
+    
+    try:
+        return fetch_chat_page(session_id, page_size, before), 200
+    except ValueError as e:
+        return {"error": str(e), "error_code": "INVALID_CURSOR"}, 400
+    except Exception as e:
+        logger.error(f"Chat history retrieval error: {e}")
+        if str(e) == "Session not found or deleted":
+            return {"error": "Session not found or deleted", "error_code": "INVALID_SESSION"}, 404
+        return {"error": str(e), "error_code": "HISTORY_RETRIEVAL_FAILED"}, 500
+
+def clear_session(data: Any) -> JsonResponse:
+    """Clear chat history for a session."""
+    try:
+        clear_session_request = ClearSessionRequest(**data)
+        if not mark_session_as_deleted(clear_session_request.session_id):
+            logger.error(f"Failed to clear session: {clear_session_request.session_id}")
+            return {"error": "Failed to clear session", "error_code": "SESSION_CLEAR_FAILED"}, 500
+
+        logger.info(f"Session cleared: {clear_session_request.session_id}")
+        return {"message": "Session cleared successfully"}, 200
+    except Exception as e:
+        logger.error(f"Clear session error: {e}")
+        return {"error": str(e), "error_code": "SESSION_CLEAR_FAILED"}, 500
+
+def health_check() -> JsonResponse:
+    """Health check endpoint."""
+    try:
+        db_status = False
+        mysql_db_status = False
+
+        conn = get_db_connection()
+        if conn:
+            db_status = conn.is_connected()
+            conn.close()
+
+        mysql_conn = get_db_connection(config=MYSQL_QUERY_CONFIG)
+        if mysql_conn:
+            mysql_db_status = mysql_conn.is_connected()
+            mysql_conn.close()
+
+        readiness = get_readiness()
+        logger.info("Health check performed")
+        return {
+            "status": "healthy" if readiness["state"] == "ready" else readiness["state"],
+            "session_database": "connected" if db_status else "disconnected",
+            "mysql_query_database": "connected" if mysql_db_status else "disconnected",
+            "warm_up_error": readiness["error"]
+        }, 200 if readiness["state"] == "ready" else 503
+    except Exception as e:
+        logger.error(f"Health check error: {e}")
+        return {"error": str(e), "error_code": "HEALTH_CHECK_FAILED"}, 500
+
+def metrics() -> JsonResponse:
+    """Runtime metrics endpoint."""
+    try:
+        return {
+            "db_pools": get_pool_stats(),
+            "intent_router": get_router_stats(),
+            "knn_intent": get_knn_stats(),
+            "index_registry": index_registry.stats(),
+            "embedding_cache": get_embedding_cache_stats(),
+            "response_cache": response_cache.stats(),
+            "turn_stages": get_stage_stats(),
+            "session_cache": session_validity.stats(),
+            "session_contexts": session_context_cache.stats(),
+            "message_writer": message_writer.stats(),
+            "order_cache": order_cache.stats()
+        }, 200
+    except Exception as e:
+        logger.error(f"Metrics error: {e}")
+        return {"error": str(e), "error_code": "METRICS_FAILED"}, 500
+
+def _parse_ticket_request(data: Any) -> Tuple[Optional[TicketRequest], Optional[JsonResponse]]:
+    ticket_request = TicketRequest(**data)
+    if not EMAIL_PATTERN.match(ticket_request.email):
+        return None, ({
+            "status": "error",
+            "message": "Invalid email format"
+        }, 400)
+    return ticket_request, None
+
+def _ticket_response(success: bool) -> JsonResponse:
+    if success:
+        return {
+            "status": "success",
+            "message": "Ticket created successfully in HubSpot"
+        }, 201
+    return {
+        "status": "error",
+        "message": "Failed to create ticket in HubSpot"
+    }, 500
+
+def _ticket_error(e: Exception) -> JsonResponse:
+    return {
+        "status": "error",
+        "message": f"An error occurred: {str(e)}"
+    }, 500
+
+def create_ticket(data: Any) -> JsonResponse:
+    """
+    Create a HubSpot ticket.
+    Expects a payload with 'email', 'conversation_history', and 'query'.
+    """
+    try:
+        ticket_request, error = _parse_ticket_request(data)
+        if error:
+            return error
+        success = create_hubspot_ticket(
+            ticket_request.email,
+            ticket_request.conversation_history,
+            ticket_request.query,
+            ticket_request.type
+        )
+        return _ticket_response(success)
+    except Exception as e:
+        return _ticket_error(e)
+
+async def create_ticket_async(data: Any) -> JsonResponse:
+    """Non-blocking create_ticket for the ASGI app."""
+    try:
+        ticket_request, error = _parse_ticket_request(data)
+        if error:
+            return error
+        success = await create_hubspot_ticket_async(
+            ticket_request.email,
+            ticket_request.conversation_history,
+            ticket_request.query,
+            ticket_request.type
+        )
+        return _ticket_response(success)
+    except Exception as e:
+        return _ticket_error(e)
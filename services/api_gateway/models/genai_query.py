@@ -1,3 +1,4 @@
+from typing import Any
 from pydantic import BaseModel
 
 class QueryRequest(BaseModel):
@@ -16,4 +17,8 @@ class TicketRequest(BaseModel):
     email: str
     conversation_history: str
     query: str
-    type: str
\ No newline at end of file
+    type: str
+
+class BatchQueryRequest(BaseModel):
+    # Items are validated one by one so a malformed item, including a non-object, fails alone
+    items: list[Any]
@@ -1,6 +1,8 @@
 import os
 import requests
+import httpx
 import logging
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
@@ -9,9 +11,11 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 HUBSPOT_API_KEY = os.getenv("HUBSPOT_API_KEY")
 HUBSPOT_API_URL = "https://api.hubapi.com/crm/v3/objects/tickets"
+HUBSPOT_TIMEOUT_SECONDS = float(os.getenv("HUBSPOT_TIMEOUT_SECONDS", "30"))
 
-def create_hubspot_ticket(email, conversation_history, query, trigger_type):
-    """Create a ticket in HubSpot with the conversation details."""
+_async_client: Optional[httpx.AsyncClient] = None
+
+def _ticket_request(email, conversation_history, query, trigger_type) -> Dict[str, Any]:
     headers = {
         "Authorization": f"Bearer {HUBSPOT_API_KEY}",
         "Content-Type": "application/json"
@@ -40,9 +44,29 @@ def create_hubspot_ticket(email, conversation_history, query, trigger_type):
                 "hs_ticket_category": "BILLING_ISSUE"
             }
         }
-    
+    return {"headers": headers, "json": ticket_data}
+
+def create_hubspot_ticket(email, conversation_history, query, trigger_type):
+    """Create a ticket in HubSpot with the conversation details."""
+    try:
+        response = requests.post(HUBSPOT_API_URL, timeout=HUBSPOT_TIMEOUT_SECONDS,
+                                 **_ticket_request(email, conversation_history, query, trigger_type))
+        if response.status_code == 201:
+            return True
+        else:
+            logger.error(f"HubSpot ticket creation failed: {response.text}")
+            return False
+    except Exception as e:
+        logger.error(f"Error creating HubSpot ticket: {str(e)}")
+        return False
+
+async def create_hubspot_ticket_async(email, conversation_history, query, trigger_type):
+    """Create a HubSpot ticket without blocking the event loop; same result as create_hubspot_ticket."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(timeout=HUBSPOT_TIMEOUT_SECONDS)
     try:
-        response = requests.post(HUBSPOT_API_URL, headers=headers, json=ticket_data)
+        response = await _async_client.post(HUBSPOT_API_URL, **_ticket_request(email, conversation_history, query, trigger_type))
         if response.status_code == 201:
             return True
         else:
@@ -50,4 +74,11 @@ def create_hubspot_ticket(email, conversation_history, query, trigger_type):
             return False
     except Exception as e:
         logger.error(f"Error creating HubSpot ticket: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+async def close_async_client() -> None:
+    """Close the shared async HTTP client; called on ASGI shutdown."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
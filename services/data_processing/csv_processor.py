@@ -1,40 +1,177 @@
 import os
 import uuid
+import hashlib
+from datetime import datetime
 import pandas as pd
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
 import logging
-from typing import Optional
+from typing import AbstractSet, Callable, Dict, Any, Iterable, Iterator, List, Optional, Set, Tuple
+from .index_registry import index_registry
+from ..genai.embedding_cache import get_embeddings, EMBEDDING_MODEL
 
 logger = logging.getLogger(__name__)
 
+# Called with rows_parsed=, chunks_embedded= or index_version= keyword updates
+ProgressCallback = Callable[..., None]
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "../../Uploads")
 FAISS_PATH = os.path.join(BASE_DIR, "data/faiss_index")
 
-def process_csv(file_path: str) -> Optional[FAISS]:
-    """Process CSV file and create FAISS vector store."""
-    global vector_store
+# Ingestion mode: "text" flattens the whole file, "rows" streams row documents, "auto" picks by file size
+CSV_INGEST_MODE = os.getenv("CSV_INGEST_MODE", "auto")
+CSV_STREAMING_THRESHOLD_MB = float(os.getenv("CSV_STREAMING_THRESHOLD_MB", "20"))
+CSV_READ_CHUNK_ROWS = int(os.getenv("CSV_READ_CHUNK_ROWS", "5000"))
+CSV_ROWS_PER_DOCUMENT = int(os.getenv("CSV_ROWS_PER_DOCUMENT", "1"))
+CSV_EMBED_BATCH_SIZE = int(os.getenv("CSV_EMBED_BATCH_SIZE", "256"))
+# Re-embed only rows that changed since the live index was built
+CSV_INCREMENTAL = os.getenv("CSV_INCREMENTAL", "false").lower() == "true"
+
+def _resolve_mode(file_path: str, mode: Optional[str]) -> str:
+    mode = mode or CSV_INGEST_MODE
+    if mode == "auto":
+        size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        return "rows" if size_mb >= CSV_STREAMING_THRESHOLD_MB else "text"
+    if mode not in ("text", "rows"):
+        raise ValueError(f"Unknown CSV ingestion mode: {mode}")
+    return mode
+
+def iter_row_documents(file_path: str, rows_per_document: int = CSV_ROWS_PER_DOCUMENT,
+                       progress: Optional[ProgressCallback] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Stream (text, metadata) documents of one row group each, reading the CSV in bounded chunks."""
+    row_offset = 0
+    for frame in pd.read_csv(file_path, chunksize=CSV_READ_CHUNK_ROWS, dtype=str, keep_default_na=False):
+        columns = list(frame.columns)
+        rows = list(frame.itertuples(index=False, name=None))
+        for start in range(0, len(rows), rows_per_document):
+            group = rows[start:start + rows_per_document]
+            text = "\n".join(
+                "; ".join(f"{column}: {value}" for column, value in zip(columns, row))
+                for row in group
+            )
+            metadata = {"source": file_path, "row": row_offset + start, "rows": len(group), "columns": columns}
+            yield text, metadata
+        row_offset += len(rows)
+        if progress:
+            progress(rows_parsed=row_offset)
+
+def iter_text_documents(file_path: str, progress: Optional[ProgressCallback] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Flatten the whole CSV to text and yield overlapping chunks of it."""
+    df = pd.read_csv(file_path)
+    if progress:
+        progress(rows_parsed=len(df))
+    csv_text = df.to_string(index=False)
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len
+    )
+    for i, chunk in enumerate(text_splitter.split_text(csv_text)):
+        yield chunk, {"chunk_id": str(uuid.uuid4()), "source": file_path, "index": i}
+
+def content_hash(text: str) -> str:
+    """Document ID derived from its content, so unchanged rows keep their ID across uploads."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _embed_batch(store: Optional[FAISS], batch: List[Tuple[str, str, Dict[str, Any]]], embeddings: Embeddings) -> FAISS:
+    ids = [doc_id for doc_id, _, _ in batch]
+    texts = [text for _, text, _ in batch]
+    metadatas = [metadata for _, _, metadata in batch]
+    text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+    if store is None:
+        return FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+    store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return store
+
+def _index_documents(documents: Iterable[Tuple[str, Dict[str, Any]]], embeddings: Embeddings,
+                     store: Optional[FAISS] = None, known: AbstractSet[str] = frozenset(),
+                     progress: Optional[ProgressCallback] = None) -> Tuple[Optional[FAISS], Set[str], int]:
+    """Embed documents whose hash is not already known, in fixed-size batches.
+
+    Returns the store, the hashes of every document seen and how many were embedded.
+    Only one batch of text is held outside the index at a time.
+    """
+    seen: Set[str] = set()
+    embedded = 0
+    batch = []
+    for text, metadata in documents:
+        doc_id = content_hash(text)
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        if doc_id in known:
+            continue
+        batch.append((doc_id, text, metadata))
+        if len(batch) >= CSV_EMBED_BATCH_SIZE:
+            store = _embed_batch(store, batch, embeddings)
+            embedded += len(batch)
+            batch = []
+            if progress:
+                progress(chunks_embedded=embedded)
+    if batch:
+        store = _embed_batch(store, batch, embeddings)
+        embedded += len(batch)
+        if progress:
+            progress(chunks_embedded=embedded)
+    return store, seen, embedded
+
+def _manifest(file_path: str, mode: str, document_ids: Set[str]) -> Dict[str, Any]:
+    return {
+        "source": os.path.basename(file_path),
+        "mode": mode,
+        "rows_per_document": CSV_ROWS_PER_DOCUMENT,
+        "embedding_model": EMBEDDING_MODEL,
+        "created_at": datetime.now().isoformat(),
+        "documents": sorted(document_ids)
+    }
+
+def _load_incremental_base(mode: str) -> Tuple[Optional[FAISS], Set[str]]:
+    """Return a private copy of the live index and its embedded hashes, if it was built compatibly."""
+    manifest = index_registry.read_manifest(FAISS_PATH)
+    if (not manifest or manifest.get("mode") != mode
+            or manifest.get("rows_per_document") != CSV_ROWS_PER_DOCUMENT
+            or manifest.get("embedding_model") != EMBEDDING_MODEL):
+        logger.info("No compatible index manifest found, re-indexing CSV from scratch")
+        return None, set()
+    return index_registry.load_copy(FAISS_PATH, manifest["index_version"]), set(manifest["documents"])
+
+def process_csv(file_path: str, mode: Optional[str] = None, incremental: Optional[bool] = None,
+                progress: Optional[ProgressCallback] = None) -> Optional[FAISS]:
+    """Process CSV file and create FAISS vector store.
+
+    In incremental mode only new or changed rows/chunks are embedded, rows missing from the
+    file are removed from the index, and unchanged content is carried over from the live index.
+    progress, if given, is called with rows_parsed, chunks_embedded and index_version as they advance.
+    """
     try:
-        df = pd.read_csv(file_path)
-        csv_text = df.to_string(index=False)
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
-        chunks = text_splitter.split_text(csv_text)
-        
-        metadatas = [{"chunk_id": str(uuid.uuid4()), "source": file_path, "index": i} 
-                     for i in range(len(chunks))]
-        
-        embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
-        vector_store = FAISS.from_texts(chunks, embeddings, metadatas=metadatas)
-        vector_store.save_local(FAISS_PATH)
-        logger.info(f"Processed CSV and saved FAISS index: {file_path}")
+        mode = _resolve_mode(file_path, mode)
+        incremental = CSV_INCREMENTAL if incremental is None else incremental
+        embeddings = get_embeddings(EMBEDDING_MODEL)
+        if mode == "rows":
+            documents = iter_row_documents(file_path, progress=progress)
+        else:
+            documents = iter_text_documents(file_path, progress=progress)
+
+        # Serialises builds across workers: an incremental build must publish on top of the version it started from
+        with index_registry.publish_lock(FAISS_PATH):
+            base, known = _load_incremental_base(mode) if incremental else (None, set())
+            vector_store, seen, embedded = _index_documents(documents, embeddings, store=base, known=known, progress=progress)
+
+            removed = known - seen
+            if vector_store is not None and removed:
+                vector_store.delete(ids=list(removed))
+            if vector_store is None or not seen:
+                raise ValueError("CSV file contains no rows")
+
+            version = index_registry.publish(FAISS_PATH, vector_store, manifest=_manifest(file_path, mode, seen))
+        if progress:
+            progress(index_version=version)
+        logger.info(f"Processed CSV ({mode} mode) and published FAISS index version {version}: {file_path} "
+                    f"({embedded} embedded, {len(seen) - embedded} unchanged, {len(removed)} removed)")
         return vector_store
     except Exception as e:
         logger.error(f"Error processing CSV: {e}")
-        raise
\ No newline at end of file
+        raise
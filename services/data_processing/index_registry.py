@@ -0,0 +1,226 @@
+import os
+import json
+import fcntl
+import time
+import uuid
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Tuple
+from langchain_community.vectorstores import FAISS
+from ..genai.embedding_cache import get_embeddings, CachedEmbeddings, EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between on-disk version checks for the same index
+INDEX_CHECK_INTERVAL = float(os.getenv("INDEX_CHECK_INTERVAL", "1.0"))
+# Superseded versions stay on disk this long so other workers can finish loading them
+INDEX_RETENTION_SECONDS = float(os.getenv("INDEX_RETENTION_SECONDS", "300"))
+
+# Layout under an index root: CURRENT names the live directory in versions/
+CURRENT_POINTER = "CURRENT"
+PUBLISH_LOCK = ".publish.lock"
+VERSIONS_DIR = "versions"
+MANIFEST_FILE = "manifest.json"
+
+class IndexRegistry:
+    """Process-wide cache of loaded FAISS indexes with atomic, versioned publishing.
+
+    Each publish writes a new directory under <root>/versions/ and then atomically
+    swaps <root>/CURRENT to point at it. Readers resolve CURRENT, so they always see
+    a complete version. A root without CURRENT is read in place (the legacy layout).
+    """
+
+    def __init__(self, check_interval: float = INDEX_CHECK_INTERVAL, retention_seconds: float = INDEX_RETENTION_SECONDS):
+        self.check_interval = check_interval
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        # root -> (version, store, last check time)
+        self._entries: Dict[str, Tuple[str, FAISS, float]] = {}
+        # (root, version) -> readers currently holding it in this process
+        self._readers: Dict[Tuple[str, str], int] = {}
+        self._stats = {"hits": 0, "loads": 0, "reloads": 0, "publishes": 0, "versions_removed": 0}
+
+    @property
+    def embeddings(self) -> CachedEmbeddings:
+        return get_embeddings(EMBEDDING_MODEL)
+
+    @staticmethod
+    def version_path(root: str, version: str) -> str:
+        """Directory holding the index files of a version."""
+        if version.startswith("legacy:"):
+            return root
+        return os.path.join(root, VERSIONS_DIR, version)
+
+    @staticmethod
+    def current_version(root: str) -> Optional[str]:
+        """Return the live version of an index root, or None if no index exists."""
+        try:
+            with open(os.path.join(root, CURRENT_POINTER), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            pass
+        try:
+            faiss_stat = os.stat(os.path.join(root, "index.faiss"))
+            pkl_stat = os.stat(os.path.join(root, "index.pkl"))
+        except FileNotFoundError:
+            return None
+        return f"legacy:{faiss_stat.st_mtime_ns}:{faiss_stat.st_size}:{pkl_stat.st_mtime_ns}:{pkl_stat.st_size}"
+
+    def _resolve(self, root: str) -> Optional[Tuple[str, FAISS]]:
+        now = time.monotonic()
+        entry = self._entries.get(root)
+        if entry is not None and now - entry[2] < self.check_interval:
+            self._stats["hits"] += 1
+            return entry[0], entry[1]
+
+        version = self.current_version(root)
+        if version is None:
+            return (entry[0], entry[1]) if entry is not None else None
+        if entry is not None and entry[0] == version:
+            self._entries[root] = (version, entry[1], now)
+            self._stats["hits"] += 1
+            return version, entry[1]
+
+        with self._lock:
+            entry = self._entries.get(root)
+            if entry is not None and entry[0] == version:
+                return version, entry[1]
+        store = self.load_copy(root, version)
+        with self._lock:
+            self._entries[root] = (version, store, now)
+            self._stats["reloads" if entry is not None else "loads"] += 1
+        logger.info(f"Loaded FAISS index version {version} from {root}")
+        if entry is not None:
+            self.cleanup(root)
+        return version, store
+
+    def get(self, root: str) -> Optional[FAISS]:
+        """Return the live index of a root, loading it on first use or after a new version is published."""
+        resolved = self._resolve(root)
+        return resolved[1] if resolved else None
+
+    @contextmanager
+    def acquire(self, root: str) -> Iterator[Optional[FAISS]]:
+        """Hold a consistent index version for the duration of the block; its files are kept until released."""
+        resolved = self._resolve(root)
+        if resolved is None:
+            yield None
+            return
+        key = (root, resolved[0])
+        with self._lock:
+            self._readers[key] = self._readers.get(key, 0) + 1
+        try:
+            yield resolved[1]
+        finally:
+            with self._lock:
+                self._release(key)
+
+    def _release(self, key: Tuple[str, str]) -> None:
+        count = self._readers.get(key, 0) - 1
+        if count > 0:
+            self._readers[key] = count
+        else:
+            self._readers.pop(key, None)
+
+    def read_manifest(self, root: str) -> Optional[Dict[str, Any]]:
+        """Return the manifest published with the live version of root, if it has one."""
+        version = self.current_version(root)
+        if version is None:
+            return None
+        try:
+            with open(os.path.join(self.version_path(root, version), MANIFEST_FILE), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        manifest["index_version"] = version
+        return manifest
+
+    def load_copy(self, root: str, version: str) -> FAISS:
+        """Load a private copy of a version that can be modified without affecting readers."""
+        key = (root, version)
+        with self._lock:
+            self._readers[key] = self._readers.get(key, 0) + 1
+        try:
+            return FAISS.load_local(self.version_path(root, version), self.embeddings, allow_dangerous_deserialization=True)
+        finally:
+            with self._lock:
+                self._release(key)
+
+    @contextmanager
+    def publish_lock(self, root: str) -> Iterator[None]:
+        """Hold the root's exclusive writer lock, shared by every process on the host.
+
+        Builds that read the live version and then publish a successor hold it throughout, so a
+        concurrent build cannot publish in between and have its changes dropped.
+        """
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, PUBLISH_LOCK), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def publish(self, root: str, store: FAISS, manifest: Optional[Dict[str, Any]] = None) -> str:
+        """Save store (and its manifest) as a new version of root and atomically make it the live one."""
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        version_path = self.version_path(root, version)
+        store.save_local(version_path)
+        if manifest is not None:
+            with open(os.path.join(version_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+
+        previous = self.current_version(root)
+        pointer_path = os.path.join(root, CURRENT_POINTER)
+        tmp_path = f"{pointer_path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, pointer_path)
+        if previous and not previous.startswith("legacy:"):
+            # Retention counts from when a version stopped being live, not from when it was built
+            try:
+                os.utime(self.version_path(root, previous))
+            except OSError:
+                pass
+
+        with self._lock:
+            self._entries[root] = (version, store, time.monotonic())
+            self._stats["publishes"] += 1
+        logger.info(f"Published FAISS index version {version} to {root}")
+        self.cleanup(root)
+        return version
+
+    def cleanup(self, root: str) -> None:
+        """Remove superseded versions that no reader in this process holds and that are past retention."""
+        versions_dir = os.path.join(root, VERSIONS_DIR)
+        if not os.path.isdir(versions_dir):
+            return
+        current = self.current_version(root)
+        cutoff = time.time() - self.retention_seconds
+        for version in os.listdir(versions_dir):
+            path = os.path.join(versions_dir, version)
+            with self._lock:
+                in_use = self._readers.get((root, version), 0) > 0
+            if version == current or in_use:
+                continue
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+                shutil.rmtree(path)
+                self._stats["versions_removed"] += 1
+                logger.info(f"Removed superseded FAISS index version {version}")
+            except OSError as e:
+                logger.warning(f"Failed to remove FAISS index version {version}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        with self._lock:
+            stats["versions"] = {root: entry[0] for root, entry in self._entries.items()}
+            stats["active_readers"] = sum(self._readers.values())
+        return stats
+
+index_registry = IndexRegistry()
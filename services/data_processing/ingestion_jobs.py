@@ -0,0 +1,264 @@
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Optional
+from .csv_processor import process_csv
+
+logger = logging.getLogger(__name__)
+
+# Uploads replace the whole index, so one worker is enough and keeps embedding load off the chat path
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "1"))
+# Queued plus running jobs accepted before uploads are rejected, across all worker processes
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "4"))
+INGEST_JOB_RETENTION_SECONDS = float(os.getenv("INGEST_JOB_RETENTION_SECONDS", "3600"))
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Job state is shared through this SQLite file so any worker can report any job
+INGEST_JOB_STORE_PATH = os.getenv("INGEST_JOB_STORE_PATH", os.path.join(BASE_DIR, "data/ingestion_jobs.sqlite3"))
+# Owners refresh heartbeat_at of their unfinished jobs this often; jobs not refreshed for
+# INGEST_JOB_STALE_SECONDS are orphans, even if a restarted worker has reused the owner's PID
+INGEST_JOB_HEARTBEAT_SECONDS = float(os.getenv("INGEST_JOB_HEARTBEAT_SECONDS", "15"))
+INGEST_JOB_STALE_SECONDS = float(os.getenv("INGEST_JOB_STALE_SECONDS", "120"))
+
+JOB_COLUMNS = ("job_id", "filename", "status", "rows_parsed", "chunks_embedded", "index_version",
+               "error", "created_at", "started_at", "finished_at", "owner_pid", "owner_token", "heartbeat_at")
+
+# pid -> token identifying this process; looked up by PID so forked workers get their own
+_process_tokens: Dict[int, str] = {}
+
+def _process_token() -> str:
+    return _process_tokens.setdefault(os.getpid(), uuid.uuid4().hex)
+
+class IngestionQueueFull(Exception):
+    """Raised when too many ingestion jobs are already queued or running."""
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class IngestionJob:
+    """Progress and outcome of one background CSV ingestion."""
+
+    def __init__(self, filename: str):
+        self.job_id = str(uuid.uuid4())
+        self.filename = filename
+        self.status = "queued"
+        self.rows_parsed = 0
+        self.chunks_embedded = 0
+        self.index_version: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        # Process running the job; a job whose owner has exited or stopped heartbeating is marked failed
+        self.owner_pid = os.getpid()
+        self.owner_token = _process_token()
+        self.heartbeat_at = time.time()
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "IngestionJob":
+        job = cls.__new__(cls)
+        for column in JOB_COLUMNS:
+            setattr(job, column, row[column])
+        for column in ("created_at", "started_at", "finished_at"):
+            value = getattr(job, column)
+            setattr(job, column, datetime.fromisoformat(value) if value else None)
+        return job
+
+    def to_row(self) -> tuple:
+        values = []
+        for column in JOB_COLUMNS:
+            value = getattr(self, column)
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        return tuple(values)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def update_progress(self, rows_parsed: Optional[int] = None, chunks_embedded: Optional[int] = None,
+                        index_version: Optional[str] = None) -> None:
+        if rows_parsed is not None:
+            self.rows_parsed = rows_parsed
+        if chunks_embedded is not None:
+            self.chunks_embedded = chunks_embedded
+        if index_version is not None:
+            self.index_version = index_version
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_parsed": self.rows_parsed,
+            "chunks_embedded": self.chunks_embedded,
+            "index_published": self.index_version is not None,
+            "index_version": self.index_version,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class IngestionJobStore:
+    """Ingestion jobs in a SQLite (WAL) file shared by every worker process on the host."""
+
+    def __init__(self, path: str = INGEST_JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Autocommit, so submit() can take the write lock with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ingestion_jobs ("
+                "job_id TEXT PRIMARY KEY, filename TEXT, status TEXT NOT NULL, rows_parsed INTEGER, "
+                "chunks_embedded INTEGER, index_version TEXT, error TEXT, created_at TEXT, started_at TEXT, "
+                "finished_at TEXT, owner_pid INTEGER, owner_token TEXT, heartbeat_at REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(ingestion_jobs)")}
+            for column, definition in (("owner_token", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in columns:
+                    # Jobs from before heartbeats have none and are reaped as stale
+                    conn.execute(f"ALTER TABLE ingestion_jobs ADD COLUMN {column} {definition}")
+            self._conn = conn
+        return self._conn
+
+    def _reap_orphans(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute(
+            "SELECT job_id, owner_pid, heartbeat_at FROM ingestion_jobs WHERE status IN ('queued', 'running')"
+        ).fetchall()
+        stale_before = time.time() - INGEST_JOB_STALE_SECONDS
+        for row in rows:
+            if row["heartbeat_at"] is None or row["heartbeat_at"] < stale_before or not _pid_alive(row["owner_pid"]):
+                conn.execute(
+                    "UPDATE ingestion_jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                    ("Worker process exited or stopped responding before the job finished", datetime.now().isoformat(), row["job_id"])
+                )
+                logger.warning(f"Marked orphaned CSV ingestion job {row['job_id']} as failed")
+
+    def add_if_capacity(self, job: IngestionJob, max_pending: int) -> None:
+        """Insert a job unless max_pending jobs are already queued or running; raises IngestionQueueFull."""
+        placeholders = ", ".join("?" * len(JOB_COLUMNS))
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cutoff = datetime.fromtimestamp(time.time() - INGEST_JOB_RETENTION_SECONDS).isoformat()
+                conn.execute("DELETE FROM ingestion_jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+                self._reap_orphans(conn)
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM ingestion_jobs WHERE status IN ('queued', 'running')"
+                ).fetchone()[0]
+                if pending >= max_pending:
+                    raise IngestionQueueFull(f"{pending} ingestion jobs already pending")
+                conn.execute(f"INSERT INTO ingestion_jobs ({', '.join(JOB_COLUMNS)}) VALUES ({placeholders})", job.to_row())
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def save(self, job: IngestionJob) -> None:
+        assignments = ", ".join(f"{column} = ?" for column in JOB_COLUMNS[1:])
+        with self._lock:
+            self._connection().execute(
+                f"UPDATE ingestion_jobs SET {assignments} WHERE job_id = ?", job.to_row()[1:] + (job.job_id,)
+            )
+
+    def heartbeat(self, owner_token: str) -> None:
+        """Mark the unfinished jobs of one process as still owned."""
+        with self._lock:
+            self._connection().execute(
+                "UPDATE ingestion_jobs SET heartbeat_at = ? WHERE owner_token = ? AND status IN ('queued', 'running')",
+                (time.time(), owner_token)
+            )
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            row = self._connection().execute("SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return IngestionJob.from_row(row) if row else None
+
+class IngestionJobManager:
+    """Runs CSV ingestion on a bounded worker pool and tracks job progress in the shared job store."""
+
+    def __init__(self, max_workers: int = INGEST_MAX_WORKERS, max_pending: int = INGEST_MAX_PENDING,
+                 store: Optional[IngestionJobStore] = None):
+        self.max_pending = max_pending
+        self.store = store or IngestionJobStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="csv-ingest")
+        self._heartbeat_pid: Optional[int] = None
+        self._heartbeat_lock = threading.Lock()
+
+    def _ensure_heartbeat(self) -> None:
+        with self._heartbeat_lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            self._heartbeat_pid = os.getpid()
+        threading.Thread(target=self._heartbeat_loop, name="csv-ingest-heartbeat", daemon=True).start()
+
+    def _heartbeat_loop(self) -> None:
+        token = _process_token()
+        while True:
+            time.sleep(INGEST_JOB_HEARTBEAT_SECONDS)
+            try:
+                self.store.heartbeat(token)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to refresh CSV ingestion job heartbeat: {e}")
+
+    def submit(self, file_path: str, filename: str, **process_kwargs: Any) -> IngestionJob:
+        """Queue a saved upload for ingestion; the file is deleted once the job finishes."""
+        job = IngestionJob(filename)
+        self._ensure_heartbeat()
+        self.store.add_if_capacity(job, self.max_pending)
+        self._executor.submit(self._run, job, file_path, process_kwargs)
+        logger.info(f"Queued CSV ingestion job {job.job_id} for {filename}")
+        return job
+
+    def _save(self, job: IngestionJob) -> None:
+        job.heartbeat_at = time.time()
+        try:
+            self.store.save(job)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to record progress of CSV ingestion job {job.job_id}: {e}")
+
+    def _run(self, job: IngestionJob, file_path: str, process_kwargs: Dict[str, Any]) -> None:
+        def progress(**updates: Any) -> None:
+            job.update_progress(**updates)
+            self._save(job)
+
+        job.status = "running"
+        job.started_at = datetime.now()
+        self._save(job)
+        try:
+            process_csv(file_path, progress=progress, **process_kwargs)
+            job.status = "succeeded"
+            logger.info(f"CSV ingestion job {job.job_id} succeeded")
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+            logger.error(f"CSV ingestion job {job.job_id} failed: {e}")
+        finally:
+            job.finished_at = datetime.now()
+            self._save(job)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self.store.get(job_id)
+
+ingestion_jobs = IngestionJobManager()
@@ -1,4 +1,7 @@
 import os
+import time
+import queue
+import threading
 import mysql.connector
 from mysql.connector import Error
 import logging
@@ -27,22 +30,195 @@ MYSQL_QUERY_CONFIG = {
     "password": os.getenv("MYSQL_QUERY_PASSWORD", "Karna!21")
 }
 
-def get_db_connection(config: Dict[str, Any] = DB_CONFIG) -> Optional[mysql.connector.connection.MySQLConnection]:
-    """Establish a database connection."""
-    try:
-        conn = mysql.connector.connect(
-            host=config["host"],
-            port=config["port"],
-            database=config["database"],
-            user=config["user"],
-            password=config["password"],
-            connection_timeout=10
-        )
-        logger.debug(f"Database connection established to {config['host']}")
-        return conn
-    except Error as e:
-        logger.error(f"Database connection error: {e}")
-        return None
+# Connection pool configuration
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+
+def _open_connection(config: Dict[str, Any]) -> mysql.connector.connection.MySQLConnection:
+    """Open a raw database connection."""
+    conn = mysql.connector.connect(
+        host=config["host"],
+        port=config["port"],
+        database=config["database"],
+        user=config["user"],
+        password=config["password"],
+        connection_timeout=10
+    )
+    logger.debug(f"Database connection established to {config['host']}")
+    return conn
+
+class PooledConnection:
+    """Borrowed pool connection; close() hands it back to the pool instead of disconnecting."""
+
+    def __init__(self, pool: "ConnectionPool", conn: mysql.connector.connection.MySQLConnection):
+        self._pool = pool
+        self._conn = conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def is_connected(self) -> bool:
+        return self._conn is not None and self._conn.is_connected()
+
+    def __getattr__(self, name: str) -> Any:
+        if self._conn is None:
+            raise Error("Connection has already been returned to the pool")
+        return getattr(self._conn, name)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+class ConnectionPool:
+    """Bounded MySQL connection pool with health-check-on-borrow and wait/borrow metrics."""
+
+    def __init__(self, config: Dict[str, Any], size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 ping_interval: float = POOL_PING_INTERVAL):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = {
+            "borrows": 0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "health_check_failures": 0,
+            "in_use": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "borrow_time_total_ms": 0.0,
+            "borrow_time_max_ms": 0.0
+        }
+        self._borrowed_at: Dict[int, float] = {}
+
+    def acquire(self) -> Optional[PooledConnection]:
+        """Borrow a healthy connection, waiting up to the pool timeout for a free slot."""
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            logger.error(f"Timed out after {self.timeout}s waiting for a connection to {self.config['host']}")
+            return None
+
+        waited_ms = (time.monotonic() - start) * 1000
+        try:
+            conn = self._checkout()
+        except Error as e:
+            self._slots.release()
+            logger.error(f"Database connection error: {e}")
+            return None
+
+        with self._lock:
+            self._stats["borrows"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_time_total_ms"] += waited_ms
+            self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], waited_ms)
+            self._borrowed_at[id(conn)] = time.monotonic()
+        return PooledConnection(self, conn)
+
+    def _checkout(self) -> mysql.connector.connection.MySQLConnection:
+        """Take an idle connection that passes its health check, or open a new one."""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                conn = _open_connection(self.config)
+                with self._lock:
+                    self._stats["connections_created"] += 1
+                return conn
+
+            if time.monotonic() - last_used < self.ping_interval:
+                return conn
+            try:
+                conn.ping(reconnect=False)
+                return conn
+            except Error as e:
+                logger.warning(f"Discarding unhealthy pooled connection to {self.config['host']}: {e}")
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                self._discard(conn)
+
+    def release(self, conn: mysql.connector.connection.MySQLConnection) -> None:
+        """Return a borrowed connection to the pool, dropping it if it is no longer usable."""
+        with self._lock:
+            self._stats["in_use"] -= 1
+            borrowed_at = self._borrowed_at.pop(id(conn), None)
+            if borrowed_at is not None:
+                held_ms = (time.monotonic() - borrowed_at) * 1000
+                self._stats["borrow_time_total_ms"] += held_ms
+                self._stats["borrow_time_max_ms"] = max(self._stats["borrow_time_max_ms"], held_ms)
+        try:
+            if conn.is_connected():
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        except Error as e:
+            logger.warning(f"Dropping pooled connection on release: {e}")
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn: mysql.connector.connection.MySQLConnection) -> None:
+        with self._lock:
+            self._stats["connections_discarded"] += 1
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the pool metrics."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "host": self.config["host"],
+            "database": self.config["database"],
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "wait_time_avg_ms": stats["wait_time_total_ms"] / stats["borrows"] if stats["borrows"] else 0.0,
+            "borrow_time_avg_ms": stats["borrow_time_total_ms"] / stats["borrows"] if stats["borrows"] else 0.0
+        })
+        return stats
+
+_pools: Dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def _pool_key(config: Dict[str, Any]) -> tuple:
+    return (config["host"], config["port"], config["database"], config["user"])
+
+def get_pool(config: Dict[str, Any] = DB_CONFIG) -> ConnectionPool:
+    """Return the process-wide pool for a database configuration, creating it on first use."""
+    key = _pool_key(config)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(config)
+                _pools[key] = pool
+    return pool
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Return metrics for the session and query database pools."""
+    return {
+        "session_database": get_pool(DB_CONFIG).stats(),
+        "mysql_query_database": get_pool(MYSQL_QUERY_CONFIG).stats()
+    }
+
+def get_db_connection(config: Dict[str, Any] = DB_CONFIG) -> Optional[PooledConnection]:
+    """Borrow a database connection from the pool; close() returns it."""
+    return get_pool(config).acquire()
 
 def execute_query(connection: mysql.connector.connection.MySQLConnection, 
                  query: str, 
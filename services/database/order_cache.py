@@ -0,0 +1,128 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+from .db_utils import get_db_connection, execute_query, MYSQL_QUERY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Bounds how long an order changed outside this service can be served stale; 0 disables the cache
+ORDER_CACHE_TTL_SECONDS = float(os.getenv("ORDER_CACHE_TTL_SECONDS", "30"))
+ORDER_CACHE_MAX_ENTRIES = int(os.getenv("ORDER_CACHE_MAX_ENTRIES", "10000"))
+
+ROW_VIEW = "row"
+
+class OrderCache:
+    """Short-TTL cache of order data keyed by order_id.
+
+    Each order can hold several views (the row itself, or the result of a lookup query); they
+    share one invalidation, so updating an order drops everything cached for it. A load that
+    overlaps an invalidation is returned to its caller but not cached. When an expired entry is
+    reloaded and has changed, it counts as a stale refresh: what the TTL would have served stale.
+    """
+
+    def __init__(self, ttl: float = ORDER_CACHE_TTL_SECONDS, max_entries: int = ORDER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (order_id, view) -> (value, loaded_at, expires_at)
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[Any, float, float]]" = OrderedDict()
+        self._views: Dict[str, Set[Hashable]] = {}
+        # order_id -> validity flags of loads in flight; invalidate() clears them
+        self._loading: Dict[str, List[List[bool]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expirations": 0, "stale_refreshes": 0,
+                       "invalidations": 0, "evictions": 0, "hit_age_total_ms": 0.0}
+
+    def _remove(self, key: Tuple[str, Hashable]) -> None:
+        del self._entries[key]
+        views = self._views.get(key[0])
+        if views is not None:
+            views.discard(key[1])
+            if not views:
+                del self._views[key[0]]
+
+    def get(self, order_id: str, view: Hashable, load: Callable[[], Any]) -> Any:
+        """Return the cached view of an order, calling load on a miss. Empty results are not cached."""
+        if self.ttl <= 0:
+            return load()
+        key = (order_id, view)
+        expired = None
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["hit_age_total_ms"] += (now - entry[1]) * 1000
+                return entry[0]
+            if entry is not None:
+                expired = entry[0]
+                self._remove(key)
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            valid = [True]
+            self._loading.setdefault(order_id, []).append(valid)
+
+        try:
+            value = load()
+        finally:
+            with self._lock:
+                loading = self._loading[order_id]
+                loading.remove(valid)
+                if not loading:
+                    del self._loading[order_id]
+        if not value:
+            # An order created meanwhile must not stay invisible for a whole TTL
+            return value
+
+        with self._lock:
+            if expired is not None and expired != value:
+                self._stats["stale_refreshes"] += 1
+            if not valid[0]:
+                return value
+            now = time.monotonic()
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, now, now + self.ttl)
+            self._views.setdefault(order_id, set()).add(view)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+        return value
+
+    def invalidate(self, order_id: str) -> None:
+        """Drop every cached view of an order; call after writing it."""
+        with self._lock:
+            self._stats["invalidations"] += 1
+            for view in list(self._views.get(order_id, ())):
+                self._remove((order_id, view))
+            # A load already in flight may have read the old row; keep it out of the cache
+            for valid in self._loading.get(order_id, ()):
+                valid[0] = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), ttl_seconds=self.ttl, max_entries=self.max_entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        stats["hit_age_avg_ms"] = stats.pop("hit_age_total_ms") / stats["hits"] if stats["hits"] else 0.0
+        return stats
+
+order_cache = OrderCache()
+
+def _load_order(order_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection(MYSQL_QUERY_CONFIG)
+    if not conn:
+        raise Exception("Database connection failed")
+    try:
+        result = execute_query(conn, "SELECT * FROM orders WHERE order_id = %s", (order_id,), fetch=True)
+        return result[0] if result else None
+    finally:
+        conn.close()
+
+def get_order(order_id: str) -> Optional[Dict[str, Any]]:
+    """Return the orders row for order_id, or None if there is no such order."""
+    return order_cache.get(order_id, ROW_VIEW, lambda: _load_order(order_id))
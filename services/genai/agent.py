@@ -1,15 +1,19 @@
 import logging
+import hashlib
+import threading
 from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 from langchain_core.messages import AIMessage, HumanMessage
-from .llm_config import llm, vector_store
+from .response_cache import invoke_prompt
+from .streaming import complete, invoke
 from .prompt_templates import ORDER_ID_PROMPT, CSV_QUERY_PROMPT, MYSQL_QUERY_PROMPT, MYSQL_RESPONSE_PROMPT, DELIVERY_DATE_PROMPT, DELIVERY_ADDRESS_PROMPT, SMALL_TALK_PROMPT, CONTINUING_QUERY_PROMPT
-from ..database.db_utils import get_db_connection, execute_query,MYSQL_QUERY_CONFIG
-from ..session.session_manager import format_chat_history_and_extract_order_id, update_session_context, session_context_cache, retrieve_chat_history, save_chat_message
+from ..database.db_utils import get_db_connection, execute_query, MYSQL_QUERY_CONFIG, POOL_SIZE, POOL_TIMEOUT
+from ..database.order_cache import order_cache, get_order
+from ..session.session_manager import format_chat_history_and_extract_order_id, update_session_context, session_context_cache, retrieve_chat_history, save_chat_message, get_session_snapshot, get_turn_extraction
+from ..data_processing.index_registry import index_registry
+from .turn_stages import start_stage, stage_result
 from langchain_community.utilities import sql_database
-from langchain_openai import OpenAIEmbeddings
 import os
-from langchain_community.vectorstores import FAISS
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -22,26 +26,30 @@ logger = logging.getLogger(__name__)
 
 def is_continuing_query(session_id: str, intent: str, query: str) -> bool:
     """Determine if the query continues an existing conversation."""
-    if session_id not in session_context_cache:
+    context = session_context_cache.get(session_id)
+    if context is None:
         return False
     
-    context = session_context_cache[session_id]
     last_intent = context.get("last_intent")
     
     if not last_intent:
         return False
     
     try:
-        waiting_for = context.get("waiting_for", "")
-        final_prompt = CONTINUING_QUERY_PROMPT.format(
-            last_intent=last_intent,
-            current_intent=intent,
-            query=query,
-            order_ids=", ".join(context["order_ids"]) if context["order_ids"] else "None",
-            waiting_for=waiting_for or "None"
-        )
-        response = llm.invoke(final_prompt)
-        final_response = response.content.strip().lower()
+        extraction = get_turn_extraction(session_id, query)
+        if extraction is not None:
+            final_response = "true" if extraction.is_continuing else "false"
+        else:
+            waiting_for = context.get("waiting_for", "")
+            response_text = invoke_prompt(
+                "CONTINUING_QUERY_PROMPT", CONTINUING_QUERY_PROMPT,
+                last_intent=last_intent,
+                current_intent=intent,
+                query=query,
+                order_ids=", ".join(sorted(context["order_ids"])) if context["order_ids"] else "None",
+                waiting_for=waiting_for or "None"
+            )
+            final_response = response_text.strip().lower()
         print(f"FINAL : {final_response}")
 
         conn = get_db_connection(MYSQL_QUERY_CONFIG)
@@ -54,12 +62,16 @@ def is_continuing_query(session_id: str, intent: str, query: str) -> bool:
                 query = "UPDATE chat_sessions SET last_order_id = NULL WHERE id = %s;"
                 result = execute_query(conn, query, (session_id,), fetch=False)
                 print(f"RES : {result}")
-                conn.close()
                 logger.info(f"last order is {session_id} removed")
+                snapshot = get_session_snapshot(session_id)
+                if snapshot is not None:
+                    snapshot.last_order_id = None
 
         except Exception as e:
             logger.error(f"Error marking session as deleted: {e}")
-            return response.content.strip().lower() == "true"            
+            return final_response == "true"            
+        finally:
+            conn.close()
     
     except Exception as e:
         logger.error(f"Error determining query type: {e}")
@@ -68,32 +80,21 @@ def is_continuing_query(session_id: str, intent: str, query: str) -> bool:
 def chat_with_csv(session_id: str, query: str) -> Dict[str, Any]:
     """Handle CSV-based FAQ queries."""
     try:
-        from .llm_config import llm, vector_store
-        if vector_store is None:
-            if os.path.exists(FAISS_PATH):
-                embeddings = OpenAIEmbeddings(model="text-embedding-ada-002", api_key=os.getenv("OPENAI_API_KEY"))
-                vector_store = FAISS.load_local(
-                    FAISS_PATH,
-                    embeddings,
-                    allow_dangerous_deserialization=True
-                )
-                logger.info("Loaded existing FAISS index")
-            else:
+        with index_registry.acquire(FAISS_PATH) as faiss_index:
+            if faiss_index is None:
                 logger.warning("No CSV data available")
                 return {"error": "No CSV data uploaded", "error_code": "NO_DATA"}
-        
-        embeddings = OpenAIEmbeddings(model="text-embedding-ada-002", api_key=os.getenv("OPENAI_API_KEY"))
-        faiss_index = FAISS.load_local(FAISS_PATH, embeddings, allow_dangerous_deserialization=True)
-        
-        def retrieve_documents(query, k=5):
-            """Retrieves top-k most relevant documents from FAISS."""
-            docs = faiss_index.similarity_search(query, k=k)
-            return "\n".join([doc.page_content for doc in docs]) if docs else "No relevant data found."
-        
-        context = retrieve_documents(query)
-        final_prompt = CSV_QUERY_PROMPT.format(context=context, query=query)
-        response = llm.invoke(final_prompt)
-        response_text = response.content.strip()
+            
+            def retrieve_documents(query, k=5):
+                """Retrieves top-k most relevant documents from FAISS."""
+                docs = faiss_index.similarity_search(query, k=k)
+                return "\n".join([doc.page_content for doc in docs]) if docs else "No relevant data found."
+            
+            context = retrieve_documents(query)
+        # Similar questions that retrieve the same FAQ context can share an answer
+        context_scope = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        response_text = invoke_prompt("CSV_QUERY_PROMPT", CSV_QUERY_PROMPT, semantic_query=query,
+                                      semantic_scope=context_scope, stream=True, context=context, query=query).strip()
         
         if not response_text:
             response_text = "I don't have enough information to answer that. Please provide more details or ask about something else."
@@ -109,6 +110,27 @@ def chat_with_csv(session_id: str, query: str) -> Dict[str, Any]:
         save_chat_message(session_id, 'assistant', response)
         return {"response": response}
 
+_sql_database: Optional[sql_database.SQLDatabase] = None
+_sql_database_lock = threading.Lock()
+
+def get_sql_database() -> sql_database.SQLDatabase:
+    """Return the shared SQLDatabase; its engine keeps a connection pool across requests."""
+    global _sql_database
+    if _sql_database is None:
+        with _sql_database_lock:
+            if _sql_database is None:
+                db_uri = f"mysql+mysqlconnector://{MYSQL_QUERY_CONFIG['user']}:{MYSQL_QUERY_CONFIG['password']}@{MYSQL_QUERY_CONFIG['host']}:{MYSQL_QUERY_CONFIG['port']}/{MYSQL_QUERY_CONFIG['database']}"
+                _sql_database = sql_database.SQLDatabase.from_uri(
+                    db_uri,
+                    engine_args={"pool_size": POOL_SIZE, "pool_pre_ping": True, "pool_timeout": POOL_TIMEOUT}
+                )
+    return _sql_database
+
+def _order_lookup_sql(kind: str, order_id: str) -> str:
+    if kind == "invoice":
+        return f"SELECT invoice_url FROM orders WHERE order_id = '{order_id}';"
+    return f"SELECT customer_name, email, shipment_status, expected_delivery, delivery_address FROM orders WHERE order_id = '{order_id}';"
+
 def chat_with_mysql(session_id: str, query: str, chat_history: Optional[List] = None) -> Dict[str, Any]:
     """Handle MySQL database queries."""
     if chat_history is None:
@@ -124,13 +146,12 @@ def chat_with_mysql(session_id: str, query: str, chat_history: Optional[List] =
         return {"response": response}
     
     try:
-        db_uri = f"mysql+mysqlconnector://{MYSQL_QUERY_CONFIG['user']}:{MYSQL_QUERY_CONFIG['password']}@{MYSQL_QUERY_CONFIG['host']}:{MYSQL_QUERY_CONFIG['port']}/{MYSQL_QUERY_CONFIG['database']}"
-        db = sql_database.SQLDatabase.from_uri(db_uri)
+        db = get_sql_database()
     except Exception as e:
         logger.error(f"Database connection failed: {e}")
         return {"error": f"Database connection failed: {str(e)}", "error_code": "DB_CONNECTION_FAILED"}
     
-    def get_sql(schema: str, formatted_history: str, query: str, order_id: Optional[str]) -> str:
+    def get_sql(formatted_history: str, query: str, order_id: Optional[str]) -> str:
         """Generate SQL query."""
         context = session_context_cache.get(session_id, {})
         email = context.get("email")
@@ -142,16 +163,14 @@ def chat_with_mysql(session_id: str, query: str, chat_history: Optional[List] =
         try:
             final_prompt = MYSQL_QUERY_PROMPT.format(
                 query=query,
-                schema=schema,
                 history=formatted_history,
                 context_info=context_info
             )
-            response = llm.invoke(final_prompt)
-            response_sql = response.content.strip()
+            response_sql = invoke(final_prompt).strip()
             if "invoice" in response_sql:
-                return f"SELECT invoice_url FROM orders WHERE order_id = '{order_id}';"
+                return _order_lookup_sql("invoice", order_id)
             elif "shipment":
-                return f"SELECT customer_name, email, shipment_status, expected_delivery, delivery_address FROM orders WHERE order_id = '{order_id}';"
+                return _order_lookup_sql("shipment", order_id)
             else:
                 return f"SELECT * FROM orders WHERE order_id = '{order_id}';"
             
@@ -169,15 +188,24 @@ def chat_with_mysql(session_id: str, query: str, chat_history: Optional[List] =
                 sql_query=sql_query,
                 sql_response=sql_response
             )
-            response = llm.invoke(final_prompt)
-            return response.content.strip()
+            return complete(final_prompt).strip()
         except Exception as e:
             logger.error(f"Response generation error: {e}")
             return "An error occurred while generating the response."
     
     try:
+        # Lookup results are cached per order and dropped when the order is updated
+        def run_lookup(sql: str) -> str:
+            return order_cache.get(order_id, sql, lambda: db.run(sql))
+        
+        # The schema and both candidate lookups only need the order ID, so they can overlap the LLM call
+        start_stage("sql_schema", None, db.get_table_info)
+        for kind in ("invoice", "shipment"):
+            candidate_sql = _order_lookup_sql(kind, order_id)
+            start_stage("order_lookup", candidate_sql, run_lookup, candidate_sql)
+        
         chat_history.append(HumanMessage(content=query))
-        sql_query = get_sql(db.get_table_info(), formatted_history, query, order_id)
+        sql_query = get_sql(formatted_history, query, order_id)
         
         if sql_query.startswith("Please provide"):
             # save_chat_message(session_id, 'user', query)
@@ -186,7 +214,7 @@ def chat_with_mysql(session_id: str, query: str, chat_history: Optional[List] =
             return {"response": sql_query}
         
         try:
-            sql_response = db.run(sql_query)
+            sql_response = stage_result("order_lookup", sql_query, lambda: run_lookup(sql_query))
         except Exception as e:
             logger.error(f"SQL execution error: {e}")
             response = "Sorry, I encountered an error. Please try again or refine your question."
@@ -194,7 +222,8 @@ def chat_with_mysql(session_id: str, query: str, chat_history: Optional[List] =
             save_chat_message(session_id, 'assistant', response)
             return {"response": response, "sql_query": sql_query, "sql_response": str(e)}
         
-        natural_language_response = get_response(db.get_table_info(), formatted_history, query, sql_query, sql_response)
+        schema = stage_result("sql_schema", None, db.get_table_info)
+        natural_language_response = get_response(schema, formatted_history, query, sql_query, sql_response)
         
         # save_chat_message(session_id, 'user', query)
         save_chat_message(session_id, 'assistant', natural_language_response)
@@ -215,25 +244,40 @@ def chat_with_mysql(session_id: str, query: str, chat_history: Optional[List] =
 def extract_delivery_date(session_id: str, query: str) -> str:
     """Extract delivery date from current query or recent chat history using LLM."""
     try:
+        extraction = get_turn_extraction(session_id, query)
+        if extraction is not None:
+            return extraction.delivery_date
+        
         current_time = datetime.now()
         current_year = current_time.year
         today_str = current_time.strftime('%Y-%m-%d')
         tomorrow_str = (current_time + timedelta(days=1)).strftime('%Y-%m-%d')
         
-        final_prompt = DELIVERY_DATE_PROMPT.format(
+        date_str = invoke_prompt(
+            "DELIVERY_DATE_PROMPT", DELIVERY_DATE_PROMPT,
             query=query,
             current_year=current_year,
             today=today_str,
             tomorrow=tomorrow_str
-        )
-        response = llm.invoke(final_prompt)
-        date_str = response.content.strip()
+        ).strip()
         
         return date_str
     except Exception as e:
         logger.error(f"Error extracting delivery date: {e}")
         return ""
 
+def _update_order(update_query: str, params: tuple, order_id: str) -> bool:
+    """Run an UPDATE on an order on a connection held only for the statement; False if none is available."""
+    conn = get_db_connection(MYSQL_QUERY_CONFIG)
+    if not conn:
+        return False
+    try:
+        execute_query(conn, update_query, params, fetch=False)
+    finally:
+        conn.close()
+    order_cache.invalidate(order_id)
+    return True
+
 def handle_reschedule_delivery(session_id: str, query: str, chat_history: Optional[List] = None) -> Dict[str, Any]:
     """Handle delivery rescheduling requests."""
     if chat_history is None:
@@ -248,23 +292,18 @@ def handle_reschedule_delivery(session_id: str, query: str, chat_history: Option
         update_session_context(session_id, "reschedule_delivery", query, waiting_for="order_id")
         return {"response": response}
     
+    # Date extraction does not depend on the eligibility check below
+    start_stage("delivery_date", query, extract_delivery_date, session_id, query)
     try:
-        conn = get_db_connection(MYSQL_QUERY_CONFIG)
-        if not conn:
-            logger.error("Database connection failed for reschedule eligibility check")
-            return {"error": "Database connection failed", "error_code": "DB_CONNECTION_FAILED"}
-        
-        query_check = "SELECT reschedule_eligible, expected_delivery, shipment_status FROM orders WHERE order_id = %s"
-        result = execute_query(conn, query_check, (order_id,), fetch=True)
+        # Served from the order cache when possible; a connection is borrowed only around the update
+        order_details = get_order(order_id)
         
-        if not result:
+        if not order_details:
             response = f"Order {order_id} not found. Please verify the order ID and try again."
             # save_chat_message(session_id, 'user', query)
             save_chat_message(session_id, 'assistant', response)
             return {"response": response}
         
-        order_details = result[0]
-        
         if not order_details['reschedule_eligible']:
             response = f"Order {order_id} can no longer be rescheduled.\n If you need further assistance, please contact our support team."
             # save_chat_message(session_id, 'user', query)
@@ -272,7 +311,7 @@ def handle_reschedule_delivery(session_id: str, query: str, chat_history: Option
             update_session_context(session_id, "reschedule_delivery", query, order_id)
             return {"response": response}
         
-        date_str = extract_delivery_date(session_id, query)
+        date_str = stage_result("delivery_date", query, lambda: extract_delivery_date(session_id, query), default="")
         
         if not date_str or date_str == '""':
             current_date = order_details['expected_delivery']
@@ -298,8 +337,9 @@ def handle_reschedule_delivery(session_id: str, query: str, chat_history: Option
                 update_session_context(session_id, "reschedule_delivery", query, order_id, waiting_for="date")
                 return {"response": response}
             
-            update_query = "UPDATE orders SET expected_delivery = %s WHERE order_id = %s"
-            execute_query(conn, update_query, (new_date, order_id), fetch=False)
+            if not _update_order("UPDATE orders SET expected_delivery = %s WHERE order_id = %s", (new_date, order_id), order_id):
+                logger.error("Database connection failed for reschedule update")
+                return {"error": "Database connection failed", "error_code": "DB_CONNECTION_FAILED"}
             
             response = f"The delivery for Order {order_id} has been rescheduled to {new_date}. \n Is there anything else I can help you with?"
             # save_chat_message(session_id, 'user', query)
@@ -319,16 +359,15 @@ def handle_reschedule_delivery(session_id: str, query: str, chat_history: Option
         save_chat_message(session_id, 'assistant', response)
         update_session_context(session_id, "reschedule_delivery", query, order_id)
         return {"response": response}
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
 
 def extract_delivery_address(session_id: str, query: str) -> str:
     """Extract delivery address from current query or recent chat history using LLM."""
     try:
-        final_prompt = DELIVERY_ADDRESS_PROMPT.format(query=query)
-        response = llm.invoke(final_prompt)
-        address = response.content.strip()
+        extraction = get_turn_extraction(session_id, query)
+        if extraction is not None:
+            address = extraction.delivery_address
+        else:
+            address = invoke_prompt("DELIVERY_ADDRESS_PROMPT", DELIVERY_ADDRESS_PROMPT, query=query).strip()
         
         if address and (len(address) < 10 or not any(char.isdigit() for char in address)):
             address = ""
@@ -352,23 +391,18 @@ def handle_address_change(session_id: str, query: str, chat_history: Optional[Li
         update_session_context(session_id, "address_change", query, waiting_for="order_id")
         return {"response": response}
     
+    # Address extraction does not depend on the eligibility check below
+    start_stage("delivery_address", query, extract_delivery_address, session_id, query)
     try:
-        conn = get_db_connection(MYSQL_QUERY_CONFIG)
-        if not conn:
-            logger.error("Database connection failed for address change eligibility check")
-            return {"error": "Database connection failed", "error_code": "DB_CONNECTION_FAILED"}
-        
-        query_check = "SELECT address_change_eligible, delivery_address, shipment_status FROM orders WHERE order_id = %s"
-        result = execute_query(conn, query_check, (order_id,), fetch=True)
+        # Served from the order cache when possible; a connection is borrowed only around the update
+        order_details = get_order(order_id)
         
-        if not result:
+        if not order_details:
             response = f"Order {order_id} not found. Please verify the order ID and try again."
             # save_chat_message(session_id, 'user', query)
             save_chat_message(session_id, 'assistant', response)
             return {"response": response}
         
-        order_details = result[0]
-        
         if not order_details['address_change_eligible']:
             response = f"Order {order_id} isn’t eligible for an address change at this stage.\n If you need further assistance, please contact our support team."
             # save_chat_message(session_id, 'user', query)
@@ -376,7 +410,7 @@ def handle_address_change(session_id: str, query: str, chat_history: Optional[Li
             update_session_context(session_id, "address_change", query, order_id)
             return {"response": response}
         
-        new_address = extract_delivery_address(session_id, query)
+        new_address = stage_result("delivery_address", query, lambda: extract_delivery_address(session_id, query), default="")
         
         if not new_address:
             current_address = order_details['delivery_address']
@@ -386,8 +420,9 @@ def handle_address_change(session_id: str, query: str, chat_history: Optional[Li
             update_session_context(session_id, "address_change", query, order_id, waiting_for="address")
             return {"response": response}
         
-        update_query = "UPDATE orders SET delivery_address = %s WHERE order_id = %s"
-        execute_query(conn, update_query, (new_address, order_id), fetch=False)
+        if not _update_order("UPDATE orders SET delivery_address = %s WHERE order_id = %s", (new_address, order_id), order_id):
+            logger.error("Database connection failed for address change update")
+            return {"error": "Database connection failed", "error_code": "DB_CONNECTION_FAILED"}
         
         response = f"The address for {order_id} has been updated to:\n  {new_address}. \n Is there anything else I can help you with?"
         # save_chat_message(session_id, 'user', query)
@@ -401,9 +436,6 @@ def handle_address_change(session_id: str, query: str, chat_history: Optional[Li
         save_chat_message(session_id, 'assistant', response)
         update_session_context(session_id, "address_change", query, order_id)
         return {"response": response}
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
 
 def handle_general_query(session_id: str, query: str) -> Dict[str, str]:
     """Handle general greetings or unrelated queries."""
@@ -461,9 +493,7 @@ Just tell me what you’d like help with!
 def handle_small_talks(session_id: str, query: str) -> Dict[str, str]:
     """Handle small talk queries like 'How are you', 'Great', 'Thanks', 'Good morning' using LLM."""
     try:
-        final_prompt = SMALL_TALK_PROMPT.format(query=query)
-        response = llm.invoke(final_prompt)
-        response_text = response.content.strip()
+        response_text = invoke_prompt("SMALL_TALK_PROMPT", SMALL_TALK_PROMPT, stream=True, query=query).strip()
 
         if not response_text:
             response_text = "Nice to chat! How can I assist with your logistics needs?"
@@ -0,0 +1,211 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(BASE_DIR, "data/embedding_cache.sqlite3"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# In-memory vectors are float32 arrays (~6 KB each for ada-002); this caps the LRU per process
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# On-disk vectors older than this are pruned, oldest first beyond the row cap
+EMBEDDING_DISK_TTL_SECONDS = float(os.getenv("EMBEDDING_DISK_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+EMBEDDING_DISK_MAX_ENTRIES = int(os.getenv("EMBEDDING_DISK_MAX_ENTRIES", "200000"))
+EMBEDDING_DISK_PRUNE_INTERVAL_SECONDS = 600
+EMBEDDING_CACHE_DISK = os.getenv("EMBEDDING_CACHE_DISK", "true").lower() == "true"
+
+class EmbeddingDiskStore:
+    """SQLite-backed vector store keyed by model and text hash, shared by all processes on the host.
+
+    Rows carry their write time; writes periodically prune rows older than ttl and the oldest
+    rows beyond max_entries.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, ttl: float = EMBEDDING_DISK_TTL_SECONDS,
+                 max_entries: int = EMBEDDING_DISK_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_prune = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL DEFAULT 0)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}
+            if "created_at" not in columns:
+                # Stores written before pruning existed start their clock now
+                conn.execute("ALTER TABLE embeddings ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE embeddings SET created_at = ?", (time.time(),))
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_created_at ON embeddings (created_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+            )
+            conn.commit()
+            if now - self._last_prune >= EMBEDDING_DISK_PRUNE_INTERVAL_SECONDS:
+                self._last_prune = now
+                self._prune(conn, now)
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute("DELETE FROM embeddings WHERE created_at < ?", (now - self.ttl,)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY created_at LIMIT ?)",
+                (excess,)
+            )
+        conn.commit()
+        if expired or excess > 0:
+            logger.info(f"Pruned {expired + max(excess, 0)} cached embeddings")
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an in-memory LRU in front of an on-disk store; only misses reach the API."""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, underlying: Optional[Embeddings] = None,
+                 disk_store: Optional[EmbeddingDiskStore] = None, max_entries: int = EMBEDDING_CACHE_SIZE,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.model = model
+        self._underlying = underlying
+        self.disk_store = disk_store
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # float32 arrays; callers get plain lists
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @property
+    def underlying(self) -> Embeddings:
+        """The API client, created on the first cache miss so importing needs no credentials."""
+        if self._underlying is None:
+            with self._lock:
+                if self._underlying is None:
+                    self._underlying = OpenAIEmbeddings(model=self.model, api_key=os.getenv("OPENAI_API_KEY"))
+        return self._underlying
+
+    def _key(self, text: str) -> str:
+        return f"{self.model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        previous = self._lru.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._lru[key] = vector
+        self._bytes += vector.nbytes
+        while self._lru and (len(self._lru) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._lru.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def _embed(self, texts: List[str], embed_fn) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    vectors[key] = vector
+            self._stats["memory_hits"] += sum(1 for key in keys if key in vectors)
+
+        pending = list(dict.fromkeys(key for key in keys if key not in vectors))
+        if pending and self.disk_store is not None:
+            try:
+                from_disk = self.disk_store.get_many(pending)
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache read failed: {e}")
+                from_disk = {}
+            vectors.update(from_disk)
+            with self._lock:
+                self._stats["disk_hits"] += len(from_disk)
+                for key, vector in from_disk.items():
+                    self._remember(key, vector)
+            pending = [key for key in pending if key not in from_disk]
+
+        if pending:
+            text_by_key = dict(zip(keys, texts))
+            embedded = {
+                key: np.asarray(vector, dtype=np.float32)
+                for key, vector in zip(pending, embed_fn([text_by_key[key] for key in pending]))
+            }
+            vectors.update(embedded)
+            with self._lock:
+                self._stats["misses"] += len(embedded)
+                for key, vector in embedded.items():
+                    self._remember(key, vector)
+            if self.disk_store is not None:
+                try:
+                    self.disk_store.put_many(embedded)
+                except sqlite3.Error as e:
+                    logger.warning(f"Embedding disk cache write failed: {e}")
+
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, lambda texts: self.underlying.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], lambda texts: [self.underlying.embed_query(texts[0])])[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._lru)
+            stats["memory_bytes"] = self._bytes
+        return stats
+
+_embeddings: Dict[str, CachedEmbeddings] = {}
+_embeddings_lock = threading.Lock()
+
+def get_embeddings(model: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """Return the process-wide cached embeddings client for a model."""
+    embeddings = _embeddings.get(model)
+    if embeddings is None:
+        with _embeddings_lock:
+            embeddings = _embeddings.get(model)
+            if embeddings is None:
+                disk_store = EmbeddingDiskStore() if EMBEDDING_CACHE_DISK else None
+                embeddings = CachedEmbeddings(model, disk_store=disk_store)
+                _embeddings[model] = embeddings
+    return embeddings
+
+def get_embedding_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Return hit/miss counters for every embeddings client created in this process."""
+    return {model: embeddings.stats() for model, embeddings in _embeddings.items()}
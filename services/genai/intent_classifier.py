@@ -1,20 +1,65 @@
 import logging
-from typing import Dict, Any
-from .llm_config import vector_store, llm
+import threading
+from typing import Dict, Any, Optional
+from .llm_config import get_faq_store
+from .response_cache import invoke_prompt
+from .embedding_cache import get_embeddings
 from .prompt_templates import INTENT_CLASSIFIER_PROMPT, LOGISTICS_QUERY_PROMPT
-from ..session.session_manager import session_context_cache, retrieve_chat_history, update_session_context,clean_old_contexts
+from .intent_router import route_intent, record_router_miss
+from .knn_intent import KNNIntentClassifier, KNN_ENABLED, KNN_LEARN_ENABLED
+from .turn_extractor import VALID_INTENTS
+from ..session.session_manager import session_context_cache, retrieve_chat_history, update_session_context, get_turn_extraction
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Local nearest-neighbour classifier consulted before the LLM; built on first use
+_knn_classifier: Optional[KNNIntentClassifier] = None
+_knn_lock = threading.Lock()
+
+def get_knn_classifier() -> Optional[KNNIntentClassifier]:
+    """Return the process-wide kNN classifier, or None when kNN classification is disabled."""
+    global _knn_classifier
+    if not KNN_ENABLED:
+        return None
+    if _knn_classifier is None:
+        with _knn_lock:
+            if _knn_classifier is None:
+                _knn_classifier = KNNIntentClassifier(get_embeddings())
+    return _knn_classifier
+
+def get_knn_stats() -> Optional[Dict[str, Any]]:
+    """Return kNN classifier metrics, or None if it has not been built in this process."""
+    return _knn_classifier.stats() if _knn_classifier is not None else None
+
 def intent_classifier(query: str, session_id: str) -> str:
     """Classify the intent of the query, returning only the intent string."""
-    if len(session_context_cache) > 100:
-        clean_old_contexts()
+    session_context = session_context_cache.get(session_id, {})
+    routed_intent = route_intent(query, session_context.get("last_intent"), session_context.get("waiting_for"))
+    if routed_intent:
+        update_session_context(session_id, routed_intent, query)
+        logger.info(f"Classified intent: {routed_intent} for query: {query} (fast path)")
+        return routed_intent
 
-    results = vector_store.similarity_search_with_score(query, k=1)
+    results = get_faq_store().similarity_search_with_score(query, k=1)
     if results[0][1] > 0.8:  # Adjust threshold as needed
+        record_router_miss("csv")
         return "csv"
+
+    # Examples are context-free, so replies to a pending question (waiting_for) are left to the LLM
+    knn_classifier = get_knn_classifier()
+    use_knn = knn_classifier is not None and not session_context.get("waiting_for")
+    if use_knn:
+        try:
+            knn_intent = knn_classifier.classify(query)
+        except Exception as e:
+            logger.warning(f"kNN intent classification failed: {e}")
+            knn_intent = None
+        if knn_intent:
+            record_router_miss(knn_intent)
+            update_session_context(session_id, knn_intent, query)
+            logger.info(f"Classified intent: {knn_intent} for query: {query} (kNN)")
+            return knn_intent
     
     try:
         context = retrieve_chat_history(session_id)
@@ -30,28 +75,34 @@ def intent_classifier(query: str, session_id: str) -> str:
             "waiting_for": None
         }
     
-    valid_intents = {"csv", "mysql", "reschedule_delivery", "address_change", "general", "small_talks", "capabilities", "frustration", "vip"}
-    
     try:
-        kwargs = {
-            "query": query,
-            "order_ids": ", ".join(context["order_ids"]) if context["order_ids"] else "None",
-            "last_intent": context["last_intent"] or "None",
-            "waiting_for": context.get("waiting_for", "None")
-        }
-        logger.debug(f"Prompt kwargs: {kwargs}")
-        
-        final_prompt = INTENT_CLASSIFIER_PROMPT.format(**kwargs)
-        logger.debug(f"Formatted prompt: {final_prompt}")
-        
-        response = llm.invoke(final_prompt)
-        intent = response.content.strip()
-        logger.debug(f"Raw LLM response for intent classification: {intent}")
+        extraction = get_turn_extraction(session_id, query)
+        if extraction is not None and extraction.intent:
+            intent = extraction.intent
+            logger.debug(f"Intent from combined turn extraction: {intent}")
+        else:
+            kwargs = {
+                "query": query,
+                "order_ids": ", ".join(sorted(context["order_ids"])) if context["order_ids"] else "None",
+                "last_intent": context["last_intent"] or "None",
+                "waiting_for": context.get("waiting_for", "None")
+            }
+            logger.debug(f"Prompt kwargs: {kwargs}")
+            
+            intent = invoke_prompt("INTENT_CLASSIFIER_PROMPT", INTENT_CLASSIFIER_PROMPT, **kwargs).strip()
+            logger.debug(f"Raw LLM response for intent classification: {intent}")
         
-        if intent not in valid_intents:
+        if intent not in VALID_INTENTS:
             logger.warning(f"Invalid intent returned: {intent}")
             return "general"
         
+        record_router_miss(intent)
+        # Only queries that open a conversation are learned; later ones may lean on last_intent
+        if use_knn and KNN_LEARN_ENABLED and not context["last_intent"]:
+            try:
+                knn_classifier.learn(query, intent)
+            except Exception as e:
+                logger.warning(f"Failed to learn intent example: {e}")
         update_session_context(session_id, intent, query)
         logger.info(f"Classified intent: {intent} for query: {query}")
         return intent
@@ -62,9 +113,8 @@ def intent_classifier(query: str, session_id: str) -> str:
 def is_logistics_query(query: str) -> bool:
     """Check if the query is related to transport, logistics, or orders."""
     try:
-        final_prompt = LOGISTICS_QUERY_PROMPT.format(query=query)
-        response = llm.invoke(final_prompt)
-        return response.content.strip().lower() == "relevant"
+        response_text = invoke_prompt("LOGISTICS_QUERY_PROMPT", LOGISTICS_QUERY_PROMPT, query=query)
+        return response_text.strip().lower() == "relevant"
     except Exception as e:
         logger.error(f"Error checking query relevance: {e}")
         return False
\ No newline at end of file
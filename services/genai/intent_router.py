@@ -0,0 +1,90 @@
+import re
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+ORDER_INTENTS = {"mysql", "reschedule_delivery", "address_change"}
+
+GREETING_PATTERN = re.compile(
+    r"^(hi|hello|hey)(\s+there)?[\s!.,]*$",
+    re.IGNORECASE
+)
+SMALL_TALK_PATTERN = re.compile(
+    r"^(thanks|thank you( so much| very much)?|thx|ty|great|awesome|cool|nice|perfect|ok(ay)?|"
+    r"good (morning|afternoon|evening)|how are you( doing)?( today)?|how's it going|"
+    r"bye|goodbye|see you( later)?|have a (good|nice) day)[\s!.,?]*$",
+    re.IGNORECASE
+)
+CAPABILITIES_PATTERN = re.compile(
+    r"^(what can you do|what do you do|how can you help( me)?|what are your capabilities|"
+    r"what can you help( me)? with|help)[\s!.,?]*$",
+    re.IGNORECASE
+)
+ORDER_ID_ONLY_PATTERN = re.compile(
+    r"^((my\s+)?order(\s+id)?(\s+is)?\s*[:#-]?\s*)?ORD\d+[\s.!]*$",
+    re.IGNORECASE
+)
+DATE_PATTERN = re.compile(
+    r"\b(today|tomorrow|day after tomorrow|next (week|monday|tuesday|wednesday|thursday|friday|saturday|sunday)|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|"
+    r"\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/-]\d{1,2}([/-]\d{2,4})?|"
+    r"jan(uary)?|feb(ruary)?|mar(ch)?|apr(il)?|may|jun(e)?|jul(y)?|aug(ust)?|sep(t(ember)?)?|oct(ober)?|nov(ember)?|dec(ember)?)\b",
+    re.IGNORECASE
+)
+ADDRESS_PATTERN = re.compile(
+    r"\d+.*(,|\b(st|street|rd|road|ave|avenue|blvd|lane|ln|drive|dr|way|court|ct|nagar|marg|sector|apt|suite)\b)"
+    r"|\b\d{5,6}\b",
+    re.IGNORECASE
+)
+
+# Longest date reply still treated as a bare slot answer
+MAX_DATE_REPLY_WORDS = 6
+
+_stats_lock = threading.Lock()
+_hits: Counter = Counter()
+_misses: Counter = Counter()
+
+def route_intent(query: str, last_intent: Optional[str] = None, waiting_for: Optional[str] = None) -> Optional[str]:
+    """Resolve unambiguous queries without the LLM; returns None when unsure."""
+    text = query.strip()
+    intent = None
+
+    if ORDER_ID_ONLY_PATTERN.match(text):
+        intent = last_intent if last_intent in ORDER_INTENTS else "mysql"
+    elif waiting_for == "date" and DATE_PATTERN.search(text) and len(text.split()) <= MAX_DATE_REPLY_WORDS:
+        intent = "reschedule_delivery"
+    elif waiting_for == "address" and "?" not in text and ADDRESS_PATTERN.search(text):
+        intent = "address_change"
+    elif GREETING_PATTERN.match(text):
+        intent = "general"
+    elif SMALL_TALK_PATTERN.match(text):
+        intent = "small_talks"
+    elif CAPABILITIES_PATTERN.match(text):
+        intent = "capabilities"
+
+    if intent:
+        with _stats_lock:
+            _hits[intent] += 1
+        logger.debug(f"Fast-path routed '{query}' to {intent}")
+    return intent
+
+def record_router_miss(intent: str) -> None:
+    """Count a query the router left to the slower classifiers, under the intent they chose."""
+    with _stats_lock:
+        _misses[intent] += 1
+
+def get_router_stats() -> Dict[str, Any]:
+    """Return per-intent hit/miss counters for the fast-path router."""
+    with _stats_lock:
+        hits = dict(_hits)
+        misses = dict(_misses)
+    total_hits = sum(hits.values())
+    total = total_hits + sum(misses.values())
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": total_hits / total if total else 0.0
+    }
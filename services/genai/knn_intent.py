@@ -0,0 +1,126 @@
+import os
+import csv
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTENT_EXAMPLES_PATH = os.path.join(BASE_DIR, "data/intent_examples.csv")
+INTENT_LEARNED_PATH = os.getenv("KNN_INTENT_LEARNED_PATH", os.path.join(BASE_DIR, "data/intent_examples_learned.csv"))
+
+KNN_ENABLED = os.getenv("KNN_INTENT_ENABLED", "true").lower() == "true"
+# Learning stores raw user queries with their LLM labels in INTENT_LEARNED_PATH, so it is opt-in
+KNN_LEARN_ENABLED = os.getenv("KNN_INTENT_LEARN", "false").lower() == "true"
+KNN_K = int(os.getenv("KNN_INTENT_K", "5"))
+# Nearest example must be at least this similar before the vote is trusted
+KNN_MIN_SIMILARITY = float(os.getenv("KNN_INTENT_MIN_SIMILARITY", "0.9"))
+# Share of the weighted top-k vote the winning intent needs
+KNN_CONFIDENCE_THRESHOLD = float(os.getenv("KNN_INTENT_CONFIDENCE", "0.8"))
+KNN_TEMPERATURE = float(os.getenv("KNN_INTENT_TEMPERATURE", "0.02"))
+KNN_MAX_LEARNED = int(os.getenv("KNN_INTENT_MAX_LEARNED", "5000"))
+# Learned examples closer than this to an existing one add nothing
+KNN_DUPLICATE_SIMILARITY = 0.98
+
+class KNNIntentClassifier:
+    """Cosine nearest-neighbour intent classifier over labelled example embeddings."""
+
+    def __init__(self, embeddings: Embeddings, examples_path: str = INTENT_EXAMPLES_PATH,
+                 learned_path: str = INTENT_LEARNED_PATH, k: int = KNN_K):
+        self.embeddings = embeddings
+        self.examples_path = examples_path
+        self.learned_path = learned_path
+        self.k = k
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._labels: List[str] = []
+        self._learned_count = 0
+        self._stats = {"hits": 0, "fallbacks": 0, "learned": 0}
+
+    def _load_examples(self) -> pd.DataFrame:
+        frames = [pd.read_csv(self.examples_path)]
+        if os.path.exists(self.learned_path):
+            learned = pd.read_csv(self.learned_path)
+            self._learned_count = len(learned)
+            frames.append(learned)
+        return pd.concat(frames, ignore_index=True).dropna()
+
+    def _ensure_loaded(self) -> None:
+        if self._matrix is not None:
+            return
+        with self._lock:
+            if self._matrix is not None:
+                return
+            examples = self._load_examples()
+            vectors = np.asarray(self.embeddings.embed_documents(examples["text"].tolist()), dtype=np.float32)
+            self._labels = examples["intent"].tolist()
+            self._matrix = _normalize(vectors)
+            logger.info(f"Loaded {len(self._labels)} intent examples for kNN classification")
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        return _normalize(np.asarray(self.embeddings.embed_query(query), dtype=np.float32))
+
+    def classify(self, query: str) -> Optional[str]:
+        """Return the voted intent when confident enough, otherwise None."""
+        self._ensure_loaded()
+        vector = self._embed_query(query)
+        matrix, labels = self._matrix, self._labels
+        similarities = matrix @ vector
+
+        k = min(self.k, len(labels))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        best_similarity = float(similarities[top].max())
+
+        # Softmax weighting: near-duplicates dominate the vote, loose neighbours barely count
+        weights = np.exp((similarities[top] - best_similarity) / KNN_TEMPERATURE)
+        votes: Dict[str, float] = {}
+        for index, weight in zip(top, weights):
+            votes[labels[index]] = votes.get(labels[index], 0.0) + float(weight)
+        intent, weight = max(votes.items(), key=lambda item: item[1])
+        total = sum(votes.values())
+        confidence = weight / total if total else 0.0
+
+        if best_similarity >= KNN_MIN_SIMILARITY and confidence >= KNN_CONFIDENCE_THRESHOLD:
+            self._stats["hits"] += 1
+            logger.debug(f"kNN classified '{query}' as {intent} (similarity {best_similarity:.3f}, confidence {confidence:.2f})")
+            return intent
+
+        self._stats["fallbacks"] += 1
+        return None
+
+    def learn(self, query: str, intent: str) -> None:
+        """Add an LLM-confirmed label to the example set and persist it."""
+        self._ensure_loaded()
+        if self._learned_count >= KNN_MAX_LEARNED:
+            return
+        vector = self._embed_query(query)
+        with self._lock:
+            if float((self._matrix @ vector).max()) >= KNN_DUPLICATE_SIMILARITY:
+                return
+            # Labels grow before the matrix so lock-free readers never index past them
+            self._labels = self._labels + [intent]
+            self._matrix = np.vstack([self._matrix, vector])
+            self._learned_count += 1
+            self._stats["learned"] += 1
+            try:
+                write_header = not os.path.exists(self.learned_path)
+                with open(self.learned_path, "a", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    if write_header:
+                        writer.writerow(["text", "intent"])
+                    writer.writerow([query, intent])
+            except OSError as e:
+                logger.error(f"Failed to persist learned intent example: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["examples"] = len(self._labels)
+        return stats
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
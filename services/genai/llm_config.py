@@ -1,10 +1,14 @@
 import os
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+import hashlib
+import threading
+from langchain_openai import ChatOpenAI
 from langchain_community.vectorstores import FAISS
 from dotenv import load_dotenv
 import logging
-from typing import Optional
+from typing import Dict, Any, Optional
 import pandas as pd
+from .embedding_cache import get_embeddings
+from ..data_processing.index_registry import index_registry
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,31 +16,89 @@ logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    logger.error("OPENAI_API_KEY not found in environment variables")
-    raise ValueError("OPENAI_API_KEY is required")
 
 # Directory configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "../../Uploads")
-FAISS_PATH = os.path.join(BASE_DIR, "../../faiss_index")
-for directory in [UPLOAD_FOLDER, FAISS_PATH]:
-    os.makedirs(directory, exist_ok=True)
-
-# Initialize LLM
-try:
-    llm = ChatOpenAI(model="gpt-4o", api_key=openai_api_key)
-except Exception as e:
-    logger.error(f"Failed to initialize LLM: {str(e)}")
-    raise
-
-# Global vector store
-vector_store: Optional[FAISS] = None
-
-# Load FAQ embeddings
-faqs_path = os.path.join(BASE_DIR, 'data/faqs.csv')  
-df = pd.read_csv(faqs_path)  # Assume columns: 'question', 'answer'
-questions = df['question'].tolist()
-embeddings = OpenAIEmbeddings()
-vector_store = FAISS.from_texts(questions, embeddings)
\ No newline at end of file
+FAQS_PATH = os.path.join(BASE_DIR, 'data/faqs.csv')
+FAQ_INDEX_PATH = os.path.join(BASE_DIR, 'data/faq_index')
+
+_llm: Optional[ChatOpenAI] = None
+_llm_lock = threading.Lock()
+_faq_store: Optional[FAISS] = None
+_faq_store_lock = threading.Lock()
+
+# Warm-up state reported by /health: "cold" -> "warming" -> "ready" or "failed"
+_readiness = {"state": "cold", "error": None}
+_readiness_lock = threading.Lock()
+
+def get_llm() -> ChatOpenAI:
+    """Return the shared chat model, creating it on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                openai_api_key = os.getenv("OPENAI_API_KEY")
+                if not openai_api_key:
+                    logger.error("OPENAI_API_KEY not found in environment variables")
+                    raise ValueError("OPENAI_API_KEY is required")
+                try:
+                    _llm = ChatOpenAI(model="gpt-4o", api_key=openai_api_key)
+                except Exception as e:
+                    logger.error(f"Failed to initialize LLM: {str(e)}")
+                    raise
+    return _llm
+
+def _faqs_hash() -> str:
+    with open(FAQS_PATH, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def get_faq_store() -> FAISS:
+    """Return the FAQ question index, loading the persisted copy or embedding faqs.csv on first use."""
+    global _faq_store
+    if _faq_store is not None:
+        return _faq_store
+
+    with _faq_store_lock:
+        if _faq_store is not None:
+            return _faq_store
+        source_hash = _faqs_hash()
+        manifest = index_registry.read_manifest(FAQ_INDEX_PATH)
+        if manifest and manifest.get("source_hash") == source_hash:
+            store = index_registry.get(FAQ_INDEX_PATH)
+            logger.info("Loaded persisted FAQ index")
+        else:
+            df = pd.read_csv(FAQS_PATH)  # Assume columns: 'question', 'answer'
+            questions = df['question'].tolist()
+            store = FAISS.from_texts(questions, get_embeddings())
+            index_registry.publish(FAQ_INDEX_PATH, store, manifest={"source": "faqs.csv", "source_hash": source_hash})
+            logger.info(f"Built FAQ index from {len(questions)} questions")
+        _faq_store = store
+        return store
+
+def _warm_up() -> None:
+    try:
+        get_llm()
+        get_faq_store()
+        with _readiness_lock:
+            _readiness.update(state="ready", error=None)
+        logger.info("LLM client and FAQ index ready")
+    except Exception as e:
+        with _readiness_lock:
+            _readiness.update(state="failed", error=str(e))
+        logger.error(f"Warm-up failed, will retry on first use: {e}")
+
+def start_warm_up() -> None:
+    """Initialise the LLM client and FAQ index on a background thread."""
+    with _readiness_lock:
+        if _readiness["state"] in ("warming", "ready"):
+            return
+        _readiness.update(state="warming", error=None)
+    threading.Thread(target=_warm_up, name="llm-warm-up", daemon=True).start()
+
+def get_readiness() -> Dict[str, Any]:
+    """Return the warm-up state of the LLM client and FAQ index."""
+    with _readiness_lock:
+        if _readiness["state"] != "ready" and _llm is not None and _faq_store is not None:
+            # Initialised lazily on first use, with or without (or despite a failed) warm-up
+            _readiness.update(state="ready", error=None)
+        return dict(_readiness)
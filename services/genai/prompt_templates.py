@@ -261,4 +261,57 @@ CSV_QUERY_PROMPT = ChatPromptTemplate.from_template(
     Provide a concise answer based only on the context. If the answer is not in the context, say so politely.
     Never reveal raw data or mention the source.
     """
-)
\ No newline at end of file
+)
+
+# Combined per-turn extraction prompt
+TURN_EXTRACTION_PROMPT = ChatPromptTemplate.from_template(
+    """
+    You are the request analyser for a Transportation & Logistics assistant. In one pass, classify the current query and extract every field below.
+
+    Current Query: {query}
+    Recent Order IDs: {order_ids}
+    Last Intent: {last_intent}
+    Waiting for: {waiting_for}
+    Session Order Id: {order_id}
+    Today: {today}
+    Tomorrow: {tomorrow}
+    Current Year: {current_year}
+
+    Fields:
+    - intent: one of csv, mysql, reschedule_delivery, address_change, general, small_talks, capabilities, frustration, vip.
+        - csv: General FAQs about placing order, payments, shipping, delivery, warranties, returns, dealers, bulk discounts or technical support.
+        - mysql: Queries about specific customer data (e.g., order details, order status, delivery dates, invoices) or actions requiring an order ID or email.
+        - reschedule_delivery: Requests to change delivery dates or times, or a date given while waiting for 'date'.
+        - address_change: Requests to update delivery addresses, or an address given while waiting for 'address'.
+        - general: Greetings limited to "Hi" or "Hello".
+        - small_talks: Casual phrases like "How are you", "Great", "Thanks", "Good morning".
+        - frustration: Annoyance, dissatisfaction, urgency or negative sentiment about the service, orders or delays.
+        - vip: Bulk shipments, large-value orders or business partnership inquiries.
+        - capabilities: Questions about the assistant's capabilities.
+    - is_continuing: true if the query continues the previous conversation (same intent as Last Intent, a small talk reply to small talk, or a date/address given while waiting for one), otherwise false.
+    - email: the email address in the query, or "".
+    - order_id: an order ID ('ORD' followed by numbers) from the current query. If none and is_continuing is true, use the Session Order Id. Otherwise "". Never invent order IDs.
+    - delivery_date: a delivery date explicitly stated in the query as YYYY-MM-DD ('today' is {today}, 'tomorrow' is {tomorrow}, dates without a year are in {current_year}). Use "" for no date, 'yesterday' or any past date.
+    - delivery_address: a delivery address (street, city, state, postal code) stated in the query, or "".
+
+    Respond with only a JSON object with exactly these keys and no extra text, e.g.:
+    {{"intent": "reschedule_delivery", "is_continuing": false, "email": "", "order_id": "ORD123", "delivery_date": "{tomorrow}", "delivery_address": ""}}
+    """
+)
+
+# Rolling conversation summary prompt
+SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    """
+    You maintain a running summary of a customer's conversation with a Transportation & Logistics assistant.
+
+    Current Summary: {summary}
+
+    New Messages:
+    {messages}
+
+    Update the summary with the new messages. Keep every order ID, email address, delivery date and
+    delivery address mentioned, what the customer asked for, what was resolved and anything still pending.
+    Drop greetings and small talk. Write at most 120 words of plain text.
+    Respond with only the updated summary.
+    """
+)
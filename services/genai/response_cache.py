@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import numpy as np
+from langchain_core.prompts import ChatPromptTemplate
+from .embedding_cache import get_embeddings
+from .streaming import complete, emit, invoke
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "20000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "true").lower() == "true"
+RESPONSE_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+
+# Seconds a response stays valid per template; templates not listed are never cached
+TEMPLATE_TTLS = {
+    "EMAIL_PROMPT": 3600,
+    "ORDER_ID_PROMPT": 600,
+    "DELIVERY_DATE_PROMPT": 3600,
+    "DELIVERY_ADDRESS_PROMPT": 3600,
+    "SMALL_TALK_PROMPT": 600,
+    "CSV_QUERY_PROMPT": 900,
+    "CONTINUING_QUERY_PROMPT": 600,
+    "INTENT_CLASSIFIER_PROMPT": 600,
+    "LOGISTICS_QUERY_PROMPT": 3600,
+    "TURN_EXTRACTION_PROMPT": 600
+}
+
+class _Entry:
+    __slots__ = ("template", "value", "expires_at", "size", "scope", "vector")
+
+    def __init__(self, template: str, value: str, expires_at: float, size: int,
+                 scope: Optional[str] = None, vector: Optional[np.ndarray] = None):
+        self.template = template
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.scope = scope
+        self.vector = vector
+
+class ResponseCache:
+    """LRU cache of LLM responses with an exact tier and an optional semantic tier.
+
+    Exact entries are keyed on the template name plus its formatted inputs. Semantic
+    entries are grouped by a scope (e.g. the retrieved FAQ context) and matched on the
+    cosine similarity of the user query's embedding.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 semantic_threshold: float = RESPONSE_CACHE_SEMANTIC_THRESHOLD):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.semantic_threshold = semantic_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._scopes: Dict[str, List[str]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._evictions = 0
+
+    def _count(self, template: str, field: str) -> None:
+        stats = self._stats.setdefault(template, {"hits": 0, "semantic_hits": 0, "misses": 0})
+        stats[field] += 1
+
+    @staticmethod
+    def exact_key(template: str, inputs: Dict[str, Any]) -> str:
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return f"{template}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def _live(self, key: str, entry: Optional[_Entry], now: float) -> Optional[_Entry]:
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, template: str, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key, self._entries.get(key), time.monotonic())
+            if entry is not None:
+                self._count(template, "hits")
+                return entry.value
+            return None
+
+    def get_semantic(self, template: str, scope: str, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            keys = self._scopes.get(scope)
+            if not keys:
+                return None
+            now = time.monotonic()
+            live = [(key, entry) for key in list(keys)
+                    if (entry := self._live(key, self._entries.get(key), now)) is not None]
+            if not live:
+                return None
+            similarities = np.stack([entry.vector for _, entry in live]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.semantic_threshold:
+                self._count(template, "semantic_hits")
+                return live[best][1].value
+            return None
+
+    def miss(self, template: str) -> None:
+        with self._lock:
+            self._count(template, "misses")
+
+    def put(self, template: str, key: str, value: str, ttl: float,
+            scope: Optional[str] = None, vector: Optional[np.ndarray] = None) -> None:
+        size = sys.getsizeof(key) + sys.getsizeof(value) + (vector.nbytes if vector is not None else 0)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(template, value, time.monotonic() + ttl, size, scope, vector)
+            self._bytes += size
+            if scope is not None:
+                self._scopes.setdefault(scope, []).append(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        if entry.scope is not None:
+            keys = self._scopes.get(entry.scope)
+            if keys is not None:
+                keys.remove(key)
+                if not keys:
+                    del self._scopes[entry.scope]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            templates = {name: dict(stats) for name, stats in self._stats.items()}
+            entries, size, evictions = len(self._entries), self._bytes, self._evictions
+        for stats in templates.values():
+            total = stats["hits"] + stats["semantic_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["hits"] + stats["semantic_hits"]) / total if total else 0.0
+        return {"entries": entries, "bytes": size, "evictions": evictions, "templates": templates}
+
+response_cache = ResponseCache()
+
+def invoke_prompt(template_name: str, template: ChatPromptTemplate, semantic_query: Optional[str] = None,
+                  semantic_scope: Optional[str] = None, stream: bool = False, **inputs: Any) -> str:
+    """Format a prompt template and return the LLM's reply text, served from the response cache when possible.
+
+    semantic_query/semantic_scope enable the semantic tier: a cached reply is reused for a
+    sufficiently similar query within the same scope. stream marks a user-facing answer whose
+    tokens go to the active token sink, if any.
+    """
+    def generate() -> str:
+        if stream:
+            return complete(template.format(**inputs))
+        return invoke(template.format(**inputs))
+
+    def served(value: str) -> str:
+        if stream:
+            emit(value)
+        return value
+
+    ttl = TEMPLATE_TTLS.get(template_name, 0) if RESPONSE_CACHE_ENABLED else 0
+    if ttl <= 0:
+        return generate()
+
+    key = ResponseCache.exact_key(template_name, inputs)
+    cached = response_cache.get(template_name, key)
+    if cached is not None:
+        return served(cached)
+
+    vector = None
+    use_semantic = RESPONSE_CACHE_SEMANTIC and semantic_query is not None and semantic_scope is not None
+    if use_semantic:
+        vector = np.asarray(get_embeddings().embed_query(semantic_query), dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        cached = response_cache.get_semantic(template_name, semantic_scope, vector)
+        if cached is not None:
+            return served(cached)
+
+    response_cache.miss(template_name)
+    value = generate()
+    response_cache.put(template_name, key, value, ttl,
+                       scope=semantic_scope if use_semantic else None, vector=vector)
+    return value
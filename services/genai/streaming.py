@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional
+from .llm_config import get_llm
+
+logger = logging.getLogger(__name__)
+
+TokenSink = Callable[[str], None]
+
+# Receives answer tokens for the request currently being streamed, if any
+_token_sink: ContextVar[Optional[TokenSink]] = ContextVar("token_sink", default=None)
+
+# Event loop of the ASGI app, if it is serving; LLM calls then go through the async OpenAI client on it
+_llm_loop: Optional[asyncio.AbstractEventLoop] = None
+_llm_loop_thread: Optional[int] = None
+
+def set_llm_loop(loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """Route LLM calls through ainvoke/astream on loop (None to go back to the sync client).
+
+    Call from the loop's own thread. Callers on other threads still wait for the result, so
+    this moves the LLM I/O onto the event loop but does not free the calling thread.
+    """
+    global _llm_loop, _llm_loop_thread
+    _llm_loop = loop
+    _llm_loop_thread = threading.get_ident() if loop is not None else None
+
+def _async_loop() -> Optional[asyncio.AbstractEventLoop]:
+    loop = _llm_loop
+    # Waiting on the loop from its own thread would deadlock
+    if loop is None or loop.is_closed() or threading.get_ident() == _llm_loop_thread:
+        return None
+    return loop
+
+@contextmanager
+def token_stream(sink: TokenSink) -> Iterator[None]:
+    """Forward tokens of final-answer LLM calls made in this context to sink."""
+    token = _token_sink.set(sink)
+    try:
+        yield
+    finally:
+        _token_sink.reset(token)
+
+def emit(text: str) -> None:
+    """Send already-complete text (e.g. a cached reply) to the active sink, if any."""
+    sink = _token_sink.get()
+    if sink is not None and text:
+        sink(text)
+
+async def _astream(prompt: Any, sink: TokenSink) -> str:
+    parts = []
+    async for chunk in get_llm().astream(prompt):
+        if chunk.content:
+            parts.append(chunk.content)
+            sink(chunk.content)
+    return "".join(parts)
+
+async def _ainvoke(prompt: Any) -> str:
+    return (await get_llm().ainvoke(prompt)).content
+
+def invoke(prompt: Any) -> str:
+    """Return the LLM's reply to a formatted prompt without streaming it."""
+    loop = _async_loop()
+    if loop is None:
+        return get_llm().invoke(prompt).content
+    return asyncio.run_coroutine_threadsafe(_ainvoke(prompt), loop).result()
+
+def complete(prompt: Any) -> str:
+    """Return the LLM's reply to a formatted prompt, streaming tokens to the active sink as they arrive."""
+    sink = _token_sink.get()
+    if sink is None:
+        return invoke(prompt)
+    loop = _async_loop()
+    if loop is not None:
+        return asyncio.run_coroutine_threadsafe(_astream(prompt, sink), loop).result()
+    parts = []
+    for chunk in get_llm().stream(prompt):
+        if chunk.content:
+            parts.append(chunk.content)
+            sink(chunk.content)
+    return "".join(parts)
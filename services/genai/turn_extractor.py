@@ -0,0 +1,96 @@
+import os
+import re
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+from .response_cache import invoke_prompt
+from .prompt_templates import TURN_EXTRACTION_PROMPT
+
+logger = logging.getLogger(__name__)
+
+# One structured LLM call per turn instead of separate intent/continuation/email/order/date/address prompts
+COMBINED_EXTRACTION = os.getenv("COMBINED_EXTRACTION", "false").lower() == "true"
+
+VALID_INTENTS = {"csv", "mysql", "reschedule_delivery", "address_change", "general", "small_talks", "capabilities", "frustration", "vip"}
+
+DATE_FORMAT_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+class TurnExtraction:
+    """Every per-turn field the handlers need, produced by a single LLM call for one query."""
+
+    def __init__(self, query: str, intent: Optional[str], is_continuing: bool, email: str,
+                 order_id: str, delivery_date: str, delivery_address: str):
+        self.query = query
+        self.intent = intent
+        self.is_continuing = is_continuing
+        self.email = email
+        self.order_id = order_id
+        self.delivery_date = delivery_date
+        self.delivery_address = delivery_address
+
+    @classmethod
+    def from_response(cls, query: str, response_text: str) -> "TurnExtraction":
+        """Parse and normalise the model's JSON reply; raises ValueError if it is not a JSON object."""
+        text = response_text.strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.find("{"):]
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("Turn extraction response is not a JSON object")
+
+        def field(name: str) -> str:
+            value = data.get(name)
+            return str(value).strip() if value else ""
+
+        intent = field("intent")
+        is_continuing = data.get("is_continuing")
+        if isinstance(is_continuing, str):
+            is_continuing = is_continuing.strip().lower() == "true"
+        email = field("email")
+        order_id = field("order_id")
+        delivery_date = field("delivery_date")
+        return cls(
+            query=query,
+            intent=intent if intent in VALID_INTENTS else None,
+            is_continuing=bool(is_continuing),
+            email=email if "@" in email else "",
+            order_id=order_id if order_id.startswith("ORD") else "",
+            delivery_date=delivery_date if DATE_FORMAT_PATTERN.match(delivery_date) else "",
+            delivery_address=field("delivery_address")
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "intent": self.intent,
+            "is_continuing": self.is_continuing,
+            "email": self.email,
+            "order_id": self.order_id,
+            "delivery_date": self.delivery_date,
+            "delivery_address": self.delivery_address
+        }
+
+def extract_turn(query: str, order_ids: Iterable[str], last_intent: Optional[str],
+                 waiting_for: Optional[str], last_order_id: Optional[str]) -> Optional[TurnExtraction]:
+    """Run the combined extraction prompt for a query; None if the call or its JSON fails."""
+    try:
+        current_time = datetime.now()
+        order_ids = sorted(order_ids)
+        response_text = invoke_prompt(
+            "TURN_EXTRACTION_PROMPT", TURN_EXTRACTION_PROMPT,
+            query=query,
+            order_ids=", ".join(order_ids) if order_ids else "None",
+            last_intent=last_intent or "None",
+            waiting_for=waiting_for or "None",
+            order_id=last_order_id or "",
+            current_year=current_time.year,
+            today=current_time.strftime('%Y-%m-%d'),
+            tomorrow=(current_time + timedelta(days=1)).strftime('%Y-%m-%d')
+        )
+        extraction = TurnExtraction.from_response(query, response_text)
+        logger.debug(f"Turn extraction for query {query}: {extraction.to_dict()}")
+        return extraction
+    except Exception as e:
+        logger.warning(f"Combined turn extraction failed, falling back to per-field prompts: {e}")
+        return None
@@ -0,0 +1,149 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Start a turn's independent LLM/DB calls concurrently instead of one after another
+PARALLEL_STAGES = os.getenv("PARALLEL_STAGES", "false").lower() == "true"
+STAGE_MAX_WORKERS = int(os.getenv("STAGE_MAX_WORKERS", "32"))
+STAGE_DEADLINE_SECONDS = float(os.getenv("STAGE_DEADLINE_SECONDS", "15"))
+
+# Seconds after start a consumer waits for a stage before giving up on it
+STAGE_DEADLINES = {
+    "turn_extraction": 20.0,
+    "email": 10.0,
+    "order_id": 10.0,
+    "sql_schema": 10.0,
+    "order_lookup": 10.0,
+    "delivery_date": 10.0,
+    "delivery_address": 10.0
+}
+
+_RAISE = object()
+
+class StageTimeout(TimeoutError):
+    """Raised when a stage misses its deadline and the consumer has no default for it."""
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_stats = {"started": 0, "used": 0, "inline": 0, "timed_out": 0, "failed": 0, "cancelled": 0, "discarded": 0}
+_stats_lock = threading.Lock()
+
+def _count(field: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[field] += amount
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=STAGE_MAX_WORKERS, thread_name_prefix="turn-stage")
+    return _executor
+
+class StageGroup:
+    """Stages started for one turn, keyed by (name, key) so a consumer only picks up work done for its inputs."""
+
+    def __init__(self):
+        self._stages: Dict[Tuple[str, Hashable], Tuple[Future, float]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, name: str, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        with self._lock:
+            if (name, key) in self._stages:
+                return
+            # Run in a copy of the caller's context so the request's session snapshot is visible
+            context = contextvars.copy_context()
+            future = _get_executor().submit(context.run, fn, *args, **kwargs)
+            deadline = time.monotonic() + STAGE_DEADLINES.get(name, STAGE_DEADLINE_SECONDS)
+            self._stages[(name, key)] = (future, deadline)
+        _count("started")
+
+    def result(self, name: str, key: Hashable, compute: Callable[[], Any], default: Any = _RAISE) -> Any:
+        with self._lock:
+            stage = self._stages.pop((name, key), None)
+        if stage is None:
+            _count("inline")
+            return compute()
+
+        future, deadline = stage
+        try:
+            value = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            _count("timed_out")
+            logger.warning(f"Stage {name} missed its deadline")
+            if default is _RAISE:
+                raise StageTimeout(f"Stage {name} missed its deadline")
+            return default
+        except Exception:
+            _count("failed")
+            raise
+        _count("used")
+        return value
+
+    def cancel(self, name: str) -> None:
+        """Drop every pending stage with this name; queued work is cancelled, running work is left to finish unused."""
+        with self._lock:
+            keys = [stage_key for stage_key in self._stages if stage_key[0] == name]
+            stages = [self._stages.pop(stage_key)[0] for stage_key in keys]
+        for future in stages:
+            _count("cancelled" if future.cancel() else "discarded")
+
+    def close(self) -> None:
+        with self._lock:
+            names = {name for name, _ in self._stages}
+        for name in names:
+            self.cancel(name)
+
+_active_group: ContextVar[Optional[StageGroup]] = ContextVar("active_stage_group", default=None)
+
+@contextmanager
+def stage_scope() -> Iterator[Optional[StageGroup]]:
+    """Collect the stages of one turn; anything still unconsumed is cancelled on exit. A no-op unless PARALLEL_STAGES."""
+    if not PARALLEL_STAGES:
+        yield None
+        return
+    group = StageGroup()
+    token = _active_group.set(group)
+    try:
+        yield group
+    finally:
+        _active_group.reset(token)
+        group.close()
+
+def start_stage(name: str, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+    """Start fn in the background for the current turn; ignored outside a stage scope."""
+    group = _active_group.get()
+    if group is not None:
+        group.start(name, key, fn, *args, **kwargs)
+
+def stage_result(name: str, key: Hashable, compute: Callable[[], Any], default: Any = _RAISE) -> Any:
+    """Return a started stage's result, or compute() inline if it was never started for this key.
+
+    A stage that misses its deadline yields default, or raises StageTimeout when no default is given.
+    """
+    group = _active_group.get()
+    if group is None:
+        return compute()
+    return group.result(name, key, compute, default)
+
+def cancel_stages(name: str) -> None:
+    """Cancel the current turn's stages with this name once their result is known to be unneeded."""
+    group = _active_group.get()
+    if group is not None:
+        group.cancel(name)
+
+def get_stage_stats() -> Dict[str, Any]:
+    """Return counters for started, used, inline, timed-out, failed and cancelled stages."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["enabled"] = PARALLEL_STAGES
+    return stats
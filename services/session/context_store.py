@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SESSION_CONTEXT_MAX_ENTRIES = int(os.getenv("SESSION_CONTEXT_MAX_ENTRIES", "10000"))
+SESSION_CONTEXT_MAX_BYTES = int(os.getenv("SESSION_CONTEXT_MAX_BYTES", str(32 * 1024 * 1024)))
+# Idle time after which a session's context is dropped
+SESSION_CONTEXT_TTL_SECONDS = float(os.getenv("SESSION_CONTEXT_TTL_SECONDS", str(2 * 60 * 60)))
+SESSION_CONTEXT_SWEEP_SECONDS = float(os.getenv("SESSION_CONTEXT_SWEEP_SECONDS", "60"))
+
+# "memory" keeps contexts per process; "sqlite" shares them between worker processes on one host
+SESSION_CONTEXT_BACKEND = os.getenv("SESSION_CONTEXT_BACKEND", "memory")
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSION_CONTEXT_PATH = os.getenv("SESSION_CONTEXT_PATH", os.path.join(BASE_DIR, "data/session_contexts.sqlite3"))
+
+def estimate_size(value: Any) -> int:
+    """Approximate bytes held by a context dict, including the members of its collections."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(key) + estimate_size(item) for key, item in value.items())
+    elif isinstance(value, (set, frozenset, list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+class SessionContextStore(MutableMapping):
+    """Session ID -> context dict with LRU eviction, entry and byte caps, and idle TTL.
+
+    Reads and writes refresh an entry's TTL. Expired entries are invisible immediately and are
+    reclaimed by a background sweep. Entry sizes are measured on assignment, so callers that
+    mutate a context in place should assign it back to keep the byte accounting current.
+    """
+
+    def __init__(self, max_entries: int = SESSION_CONTEXT_MAX_ENTRIES, max_bytes: int = SESSION_CONTEXT_MAX_BYTES,
+                 ttl: float = SESSION_CONTEXT_TTL_SECONDS, sweep_interval: float = SESSION_CONTEXT_SWEEP_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        # session_id -> (context, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._sweeper: Optional[threading.Thread] = None
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper is None and self.sweep_interval > 0:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="session-context-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                expired = self.expire()
+                if expired:
+                    logger.debug(f"Expired {expired} session contexts")
+            except Exception as e:
+                logger.error(f"Session context sweep failed: {e}")
+
+    def _remove(self, session_id: str) -> None:
+        _, _, size = self._entries.pop(session_id)
+        self._bytes -= size
+
+    def _live(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        context, expires_at, size = entry
+        if expires_at <= now:
+            self._remove(session_id)
+            self._stats["expirations"] += 1
+            return None
+        self._entries[session_id] = (context, now + self.ttl, size)
+        self._entries.move_to_end(session_id)
+        return context
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            context = self._live(session_id, time.monotonic())
+            if context is None:
+                self._stats["misses"] += 1
+                raise KeyError(session_id)
+            self._stats["hits"] += 1
+            return context
+
+    def __contains__(self, session_id: object) -> bool:
+        with self._lock:
+            return self._live(session_id, time.monotonic()) is not None
+
+    def __setitem__(self, session_id: str, context: Dict[str, Any]) -> None:
+        size = estimate_size(context)
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+            self._entries[session_id] = (context, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                if oldest == session_id and len(self._entries) == 1:
+                    break
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+        self._ensure_sweeper()
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            if session_id not in self._entries:
+                raise KeyError(session_id)
+            self._remove(session_id)
+
+    def __iter__(self) -> Iterator[str]:
+        now = time.monotonic()
+        with self._lock:
+            keys: List[str] = [session_id for session_id, (_, expires_at, _) in self._entries.items() if expires_at > now]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def expire(self) -> int:
+        """Drop every expired entry; returns how many were removed."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for session_id, (_, expires_at, _) in self._entries.items() if expires_at <= now]
+            for session_id in expired:
+                self._remove(session_id)
+            self._stats["expirations"] += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._bytes,
+                         max_entries=self.max_entries, max_bytes=self.max_bytes)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
+
+def encode_context(context: Dict[str, Any]) -> str:
+    """Compact JSON for a context dict; sets and datetimes are tagged so they round-trip."""
+    def default(value: Any) -> Any:
+        if isinstance(value, (set, frozenset)):
+            return {"$set": sorted(value, key=str)}
+        if isinstance(value, datetime):
+            return {"$dt": value.isoformat()}
+        raise TypeError(f"Cannot serialise {type(value).__name__} in session context")
+    return json.dumps(context, default=default, separators=(",", ":"))
+
+def decode_context(text: str) -> Dict[str, Any]:
+    def object_hook(value: Dict[str, Any]) -> Any:
+        if len(value) == 1:
+            if "$set" in value:
+                return set(value["$set"])
+            if "$dt" in value:
+                return datetime.fromisoformat(value["$dt"])
+        return value
+    return json.loads(text, object_hook=object_hook)
+
+class SqliteContextStore(MutableMapping):
+    """Session contexts in a SQLite (WAL) file shared by every worker process on the host.
+
+    Reads go through a local SessionContextStore that is dropped whenever another process
+    commits (PRAGMA data_version changes), so a lookup with no foreign writes in between never
+    touches the database. Contexts mutated in place must be assigned back to be persisted.
+    """
+
+    def __init__(self, path: str = SESSION_CONTEXT_PATH, ttl: float = SESSION_CONTEXT_TTL_SECONDS,
+                 sweep_interval: float = SESSION_CONTEXT_SWEEP_SECONDS, local_max_entries: int = SESSION_CONTEXT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._local = SessionContextStore(max_entries=local_max_entries, ttl=ttl, sweep_interval=0)
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._stats = {"local_hits": 0, "reads": 0, "writes": 0, "invalidations": 0}
+        self._sweeper: Optional[threading.Thread] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_contexts "
+                "(session_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+            if self.sweep_interval > 0:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="session-context-sweeper", daemon=True)
+                self._sweeper.start()
+        return self._conn
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                expired = self.expire()
+                if expired:
+                    logger.debug(f"Expired {expired} shared session contexts")
+            except Exception as e:
+                logger.error(f"Shared session context sweep failed: {e}")
+
+    def _sync(self, conn: sqlite3.Connection) -> None:
+        # data_version changes only when another connection has committed
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            if self._data_version is not None:
+                self._stats["invalidations"] += 1
+            self._local.clear()
+            self._data_version = data_version
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connection()
+            self._sync(conn)
+            if session_id in self._local:
+                self._stats["local_hits"] += 1
+                return self._local[session_id]
+            self._stats["reads"] += 1
+            row = conn.execute(
+                "SELECT data FROM session_contexts WHERE session_id = ? AND expires_at > ?",
+                (session_id, time.time())
+            ).fetchone()
+            if row is None:
+                raise KeyError(session_id)
+            context = decode_context(row[0])
+            self._local[session_id] = context
+            return context
+
+    def __contains__(self, session_id: object) -> bool:
+        try:
+            self[session_id]
+            return True
+        except KeyError:
+            return False
+
+    def __setitem__(self, session_id: str, context: Dict[str, Any]) -> None:
+        data = encode_context(context)
+        with self._lock:
+            conn = self._connection()
+            self._sync(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO session_contexts (session_id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, data, time.time() + self.ttl)
+            )
+            conn.commit()
+            self._stats["writes"] += 1
+            self._local[session_id] = context
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            self._sync(conn)
+            cursor = conn.execute("DELETE FROM session_contexts WHERE session_id = ?", (session_id,))
+            conn.commit()
+            self._local.pop(session_id, None)
+            if cursor.rowcount == 0:
+                raise KeyError(session_id)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT session_id FROM session_contexts WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM session_contexts WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+
+    def expire(self) -> int:
+        """Delete expired contexts from the shared file; returns how many were removed."""
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute("DELETE FROM session_contexts WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            self._local.expire()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backend"] = "sqlite"
+        stats["local"] = self._local.stats()
+        total = stats["local_hits"] + stats["reads"]
+        stats["local_hit_rate"] = stats["local_hits"] / total if total else 0.0
+        return stats
+
+def create_context_store() -> MutableMapping:
+    """Build the session context backend selected by SESSION_CONTEXT_BACKEND ("memory" or "sqlite")."""
+    if SESSION_CONTEXT_BACKEND == "memory":
+        return SessionContextStore()
+    if SESSION_CONTEXT_BACKEND == "sqlite":
+        logger.info(f"Using shared SQLite session context store at {SESSION_CONTEXT_PATH}")
+        return SqliteContextStore()
+    raise ValueError(f"Unknown session context backend: {SESSION_CONTEXT_BACKEND}")
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+from mysql.connector import errors as mysql_errors
+from ..database.db_utils import get_db_connection, execute_query
+
+logger = logging.getLogger(__name__)
+
+# When enabled, chat messages are queued and inserted in batches by a background thread
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+MESSAGE_WRITER_MAX_QUEUE = int(os.getenv("MESSAGE_WRITER_MAX_QUEUE", "10000"))
+MESSAGE_WRITER_BATCH_SIZE = int(os.getenv("MESSAGE_WRITER_BATCH_SIZE", "200"))
+MESSAGE_WRITER_FLUSH_SECONDS = float(os.getenv("MESSAGE_WRITER_FLUSH_SECONDS", "0.05"))
+# How long a producer waits for queue space before writing its message synchronously
+MESSAGE_WRITER_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("MESSAGE_WRITER_ENQUEUE_TIMEOUT_SECONDS", "2"))
+MESSAGE_WRITER_DRAIN_SECONDS = float(os.getenv("MESSAGE_WRITER_DRAIN_SECONDS", "30"))
+MESSAGE_WRITER_MAX_BACKOFF_SECONDS = 5.0
+# Attempts a message gets when it fails on its own; after that it is written to the dead-letter file
+MESSAGE_WRITER_MAX_ATTEMPTS = int(os.getenv("MESSAGE_WRITER_MAX_ATTEMPTS", "3"))
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESSAGE_WRITER_DEAD_LETTER_PATH = os.getenv(
+    "MESSAGE_WRITER_DEAD_LETTER_PATH", os.path.join(BASE_DIR, "data/chat_messages_dead_letter.jsonl")
+)
+
+class PendingMessage(NamedTuple):
+    message_id: str
+    session_id: str
+    role: str
+    message: str
+    timestamp: datetime
+
+def _is_transient(error: Exception) -> bool:
+    """True for failures of the database rather than of the rows, e.g. a lost or unavailable connection."""
+    return isinstance(error, (mysql_errors.InterfaceError, mysql_errors.OperationalError)) or str(error) == "Database connection failed"
+
+def dead_letter(messages: List[PendingMessage], error: Exception) -> None:
+    """Append messages that could not be inserted to the dead-letter file so they can be replayed."""
+    try:
+        os.makedirs(os.path.dirname(MESSAGE_WRITER_DEAD_LETTER_PATH), exist_ok=True)
+        with open(MESSAGE_WRITER_DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+            for m in messages:
+                record = m._asdict()
+                record["timestamp"] = m.timestamp.isoformat()
+                record["error"] = str(error)
+                f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        logger.error(f"Failed to dead-letter {len(messages)} chat messages ({[m.message_id for m in messages]}): {e}")
+
+def insert_messages(messages: List[PendingMessage]) -> None:
+    """Insert messages with one multi-row INSERT; raises on failure."""
+    conn = get_db_connection()
+    if not conn:
+        raise Exception("Database connection failed")
+    try:
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * len(messages))
+        query = f"INSERT INTO chat_messages (id, chat_id, role, message, timestamp) VALUES {placeholders}"
+        params = tuple(value for m in messages for value in (m.message_id, m.session_id, m.role, m.message, m.timestamp))
+        execute_query(conn, query, params, fetch=False)
+    finally:
+        conn.close()
+
+class MessageWriter:
+    """Bounded write-behind queue for chat messages.
+
+    Messages get an explicit, strictly increasing timestamp when queued, so history order does not
+    depend on when a batch reaches the database. Until its batch commits, a message stays visible
+    through pending(). A full queue blocks producers for up to enqueue_timeout, after which the
+    message is written synchronously instead of being dropped.
+
+    When a batch fails because of its rows, each row is retried on its own so one bad message
+    cannot hold back the rest; a row that keeps failing is moved to the dead-letter file after
+    max_attempts. Batches that fail because the database is unavailable are retried whole.
+    """
+
+    def __init__(self, max_queue: int = MESSAGE_WRITER_MAX_QUEUE, batch_size: int = MESSAGE_WRITER_BATCH_SIZE,
+                 flush_interval: float = MESSAGE_WRITER_FLUSH_SECONDS,
+                 enqueue_timeout: float = MESSAGE_WRITER_ENQUEUE_TIMEOUT_SECONDS,
+                 max_attempts: int = MESSAGE_WRITER_MAX_ATTEMPTS):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_attempts = max_attempts
+        self._queue: Deque[PendingMessage] = deque()
+        # session_id -> queued or in-flight messages, oldest first
+        self._pending: Dict[str, List[PendingMessage]] = {}
+        self._in_flight = 0
+        # message_id -> failed attempts, for messages that failed on their own
+        self._attempts: Dict[str, int] = {}
+        self._last_timestamp = datetime.min
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"enqueued": 0, "flushed": 0, "batches": 0, "flush_failures": 0,
+                       "backpressure_waits": 0, "sync_writes": 0, "max_depth": 0, "row_retries": 0, "dead_lettered": 0}
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def _next_timestamp(self) -> datetime:
+        timestamp = datetime.now()
+        if timestamp <= self._last_timestamp:
+            timestamp = self._last_timestamp + timedelta(microseconds=1)
+        self._last_timestamp = timestamp
+        return timestamp
+
+    def submit(self, session_id: str, role: str, message: str) -> bool:
+        """Queue a message for insertion; returns False only if a synchronous fallback write failed."""
+        with self._cond:
+            pending = PendingMessage(str(uuid.uuid4()), session_id, role, message, self._next_timestamp())
+            if self._closed:
+                queued = False
+            else:
+                self._ensure_thread()
+                if len(self._queue) >= self.max_queue:
+                    self._stats["backpressure_waits"] += 1
+                    self._cond.wait_for(lambda: len(self._queue) < self.max_queue or self._closed, self.enqueue_timeout)
+                queued = len(self._queue) < self.max_queue and not self._closed
+            if queued:
+                self._queue.append(pending)
+                self._pending.setdefault(session_id, []).append(pending)
+                self._stats["enqueued"] += 1
+                self._stats["max_depth"] = max(self._stats["max_depth"], len(self._queue))
+                if len(self._queue) >= self.batch_size:
+                    self._cond.notify_all()
+                return True
+            self._stats["sync_writes"] += 1
+
+        try:
+            insert_messages([pending])
+            return True
+        except Exception as e:
+            logger.error(f"Error saving chat message: {e}")
+            return False
+
+    def pending(self, session_id: str) -> List[PendingMessage]:
+        """Messages for a session that are not yet committed, oldest first."""
+        with self._cond:
+            return list(self._pending.get(session_id, ()))
+
+    def _take_batch(self) -> List[PendingMessage]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self._closed)
+            if not self._closed and len(self._queue) < self.batch_size:
+                # Give the batch time to fill before flushing on the interval
+                self._cond.wait_for(lambda: len(self._queue) >= self.batch_size or self._closed, self.flush_interval)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._in_flight = len(batch)
+            return batch
+
+    def _settle(self, saved: List[PendingMessage], retry: List[PendingMessage], dead: List[PendingMessage]) -> None:
+        with self._cond:
+            self._in_flight = 0
+            done = {m.message_id for m in saved + dead}
+            for session_id in {m.session_id for m in saved + dead}:
+                remaining = [m for m in self._pending.get(session_id, ()) if m.message_id not in done]
+                if remaining:
+                    self._pending[session_id] = remaining
+                else:
+                    self._pending.pop(session_id, None)
+            for message_id in done:
+                self._attempts.pop(message_id, None)
+            self._queue.extendleft(reversed(retry))
+            self._stats["flushed"] += len(saved)
+            self._stats["dead_lettered"] += len(dead)
+            if saved:
+                self._stats["batches"] += 1
+            self._cond.notify_all()
+
+    def _insert_rows(self, batch: List[PendingMessage]) -> bool:
+        """Insert a failed batch row by row; returns False if the database itself is unavailable."""
+        saved, retry, dead = [], [], []
+        for i, message in enumerate(batch):
+            try:
+                insert_messages([message])
+                saved.append(message)
+            except Exception as e:
+                if _is_transient(e):
+                    self._settle(saved, retry + batch[i:], dead)
+                    return False
+                with self._cond:
+                    attempts = self._attempts.get(message.message_id, 0) + 1
+                    self._attempts[message.message_id] = attempts
+                    self._stats["row_retries"] += 1
+                if attempts >= self.max_attempts:
+                    logger.error(f"Dead-lettering chat message {message.message_id} after {attempts} attempts: {e}")
+                    dead_letter([message], e)
+                    dead.append(message)
+                else:
+                    retry.append(message)
+        self._settle(saved, retry, dead)
+        return not retry
+
+    def _run(self) -> None:
+        failures = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                insert_messages(batch)
+                self._settle(batch, [], [])
+                failures = 0
+                continue
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} chat messages: {e}")
+                with self._cond:
+                    self._stats["flush_failures"] += 1
+                if _is_transient(e):
+                    self._settle([], batch, [])
+                    ok = False
+                else:
+                    ok = self._insert_rows(batch)
+            if ok:
+                failures = 0
+            else:
+                failures += 1
+                time.sleep(min(MESSAGE_WRITER_MAX_BACKOFF_SECONDS, 0.1 * 2 ** failures))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is committed; False on timeout."""
+        with self._cond:
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+
+    def close(self, timeout: float = MESSAGE_WRITER_DRAIN_SECONDS) -> None:
+        """Stop accepting messages and drain the queue; later submits write synchronously.
+
+        Messages still unsaved when timeout expires are written to the dead-letter file.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._cond:
+            # Queued and in-flight messages; the writer thread stops once the queue is empty
+            unsaved = sorted((m for pending in self._pending.values() for m in pending), key=lambda m: m.timestamp)
+            self._queue.clear()
+            self._pending.clear()
+            self._attempts.clear()
+            self._stats["dead_lettered"] += len(unsaved)
+        if unsaved:
+            logger.error(f"Message writer closed with {len(unsaved)} chat messages unsaved; dead-lettering them")
+            dead_letter(unsaved, Exception("Message writer closed before the messages were saved"))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(enabled=MESSAGE_WRITE_BEHIND, depth=len(self._queue), in_flight=self._in_flight,
+                         max_queue=self.max_queue, batch_size=self.batch_size)
+        return stats
+
+message_writer = MessageWriter()
+atexit.register(message_writer.close)
@@ -0,0 +1,108 @@
+import logging
+from typing import List, Tuple
+from ..database.db_utils import get_db_connection, execute_query
+
+logger = logging.getLogger(__name__)
+
+# (table, column, definition)
+COLUMNS: List[Tuple[str, str, str]] = [
+    # Compact JSON session context, persisted so it survives restarts
+    ("chat_sessions", "context", "TEXT NULL"),
+    ("chat_sessions", "context_updated_at", "DATETIME(6) NULL"),
+    # Rolling summary of the conversation up to and including message (summary_until, summary_until_id)
+    ("chat_sessions", "summary", "TEXT NULL"),
+    ("chat_sessions", "summary_until", "DATETIME(6) NULL"),
+    ("chat_sessions", "summary_until_id", "VARCHAR(36) NULL"),
+]
+
+# (table, column, type) widened in place, keeping nullability and a CURRENT_TIMESTAMP default/on update.
+# History is ordered on (timestamp, id); without microseconds, messages written in the same second
+# (e.g. the write-behind writer's explicit timestamps) would come back in id order
+COLUMN_TYPES: List[Tuple[str, str, str]] = [
+    ("chat_messages", "timestamp", "DATETIME(6)"),
+]
+
+# (table, index name, columns); history windows and pages walk the first index backwards from a keyset position
+INDEXES: List[Tuple[str, str, str]] = [
+    ("chat_messages", "idx_chat_messages_chat_ts_id", "chat_id, timestamp, id"),
+    ("chat_sessions", "idx_chat_sessions_context_updated", "context_updated_at"),
+]
+
+def _column_exists(conn, table: str, name: str) -> bool:
+    query = """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """
+    return bool(execute_query(conn, query, (table, name), fetch=True))
+
+def _index_exists(conn, table: str, name: str) -> bool:
+    query = """
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """
+    return bool(execute_query(conn, query, (table, name), fetch=True))
+
+def _widen_column(conn, table: str, name: str, column_type: str) -> None:
+    query = """
+        SELECT column_type, is_nullable, column_default, extra FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """
+    rows = execute_query(conn, query, (table, name), fetch=True)
+    if not rows:
+        return
+    row = {key.lower(): value for key, value in rows[0].items()}
+    if row["column_type"].lower() == column_type.lower():
+        return
+    definition = f"{column_type} {'NULL' if row['is_nullable'] == 'YES' else 'NOT NULL'}"
+    default = row["column_default"]
+    if default is not None:
+        if "CURRENT_TIMESTAMP" in str(default).upper():
+            definition += " DEFAULT CURRENT_TIMESTAMP(6)"
+        else:
+            definition += " DEFAULT '" + str(default).replace("'", "''") + "'"
+    if "ON UPDATE CURRENT_TIMESTAMP" in (row["extra"] or "").upper():
+        definition += " ON UPDATE CURRENT_TIMESTAMP(6)"
+    logger.info(f"Changing {table}.{name} from {row['column_type']} to {column_type}; this rebuilds the table")
+    execute_query(conn, f"ALTER TABLE {table} MODIFY COLUMN `{name}` {definition}", fetch=False)
+
+def ensure_schema() -> bool:
+    """Add the columns and indexes the session queries rely on, if missing. Safe to run from every worker."""
+    conn = get_db_connection()
+    if not conn:
+        logger.error("Schema bootstrap skipped: No database connection")
+        return False
+
+    ok = True
+    try:
+        for table, name, definition in COLUMNS:
+            try:
+                if not _column_exists(conn, table, name):
+                    execute_query(conn, f"ALTER TABLE {table} ADD COLUMN {name} {definition}", fetch=False)
+                    logger.info(f"Added column {table}.{name}")
+            except Exception as e:
+                if _column_exists(conn, table, name):
+                    continue
+                logger.error(f"Failed to add column {table}.{name}: {e}")
+                ok = False
+        for table, name, column_type in COLUMN_TYPES:
+            try:
+                _widen_column(conn, table, name, column_type)
+            except Exception as e:
+                logger.error(f"Failed to change {table}.{name} to {column_type}: {e}")
+                ok = False
+        for table, name, columns in INDEXES:
+            try:
+                if not _index_exists(conn, table, name):
+                    execute_query(conn, f"CREATE INDEX {name} ON {table} ({columns})", fetch=False)
+                    logger.info(f"Created index {name} on {table} ({columns})")
+            except Exception as e:
+                # Another worker may have created it first
+                if _index_exists(conn, table, name):
+                    continue
+                logger.error(f"Failed to create index {name} on {table}: {e}")
+                ok = False
+        return ok
+    finally:
+        conn.close()
@@ -0,0 +1,69 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bounds how long another worker may keep treating a deleted session as valid
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "300"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "100000"))
+
+class SessionValidityCache:
+    """Per-process TTL cache of session ID -> owning client ID, or None for a missing/deleted session.
+
+    Entries are written when a session is created or loaded and overwritten with None when it is
+    deleted here; other workers converge when their entry expires, after at most ttl seconds.
+    """
+
+    def __init__(self, ttl: float = SESSION_CACHE_TTL_SECONDS, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "rejections": 0}
+
+    def lookup(self, session_id: str) -> Tuple[bool, Optional[str]]:
+        """Return (found, client_id); client_id is None for a session known to be missing or deleted."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[session_id]
+                self._stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(session_id)
+            self._stats["hits"] += 1
+            return True, entry[0]
+
+    def rejects(self, session_id: str, client_id: str) -> bool:
+        """True if the cache already knows this session is missing, deleted or owned by another client."""
+        found, cached_client_id = self.lookup(session_id)
+        if found and cached_client_id != client_id:
+            with self._lock:
+                self._stats["rejections"] += 1
+            return True
+        return False
+
+    def put(self, session_id: str, client_id: Optional[str]) -> None:
+        with self._lock:
+            self._entries[session_id] = (client_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id: str) -> None:
+        """Record a session as deleted in this process."""
+        self.put(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
+
+session_validity = SessionValidityCache()
@@ -1,16 +1,278 @@
+import os
 import uuid
+import base64
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 import logging
-from typing import Dict, Any, Optional, Tuple
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
 from langchain_core.messages import AIMessage, HumanMessage
 from ..database.db_utils import get_db_connection, execute_query, MYSQL_QUERY_CONFIG
-from ..genai.llm_config import llm
+from ..genai.response_cache import invoke_prompt
 from ..genai.prompt_templates import ORDER_ID_PROMPT, EMAIL_PROMPT
+from ..genai.turn_extractor import TurnExtraction, extract_turn, COMBINED_EXTRACTION
+from ..genai.turn_stages import start_stage, stage_result
+from .session_cache import session_validity
+from .context_store import create_context_store, encode_context, decode_context, SESSION_CONTEXT_TTL_SECONDS, SESSION_CONTEXT_MAX_ENTRIES
+from .message_writer import message_writer, MESSAGE_WRITE_BEHIND
+from .summarizer import SUMMARY_ENABLED, SUMMARY_KEEP_MESSAGES
 
 logger = logging.getLogger(__name__)
 
-# Session context cache
-session_context_cache = {}
+# Session context cache; bounded, with idle expiry, in process memory or shared per SESSION_CONTEXT_BACKEND
+session_context_cache = create_context_store()
+
+# An unchanged context is re-persisted at most this often, so preload and rehydration still see the session as active
+SESSION_CONTEXT_PERSIST_REFRESH_SECONDS = float(os.getenv("SESSION_CONTEXT_PERSIST_REFRESH_SECONDS", str(SESSION_CONTEXT_TTL_SECONDS / 4)))
+
+# session_id -> (fingerprint, context_updated_at) of the context last written to or read from chat_sessions
+_persisted_contexts: "OrderedDict[str, Tuple[str, datetime]]" = OrderedDict()
+_persisted_lock = threading.Lock()
+
+def _context_fingerprint(context: Dict[str, Any]) -> str:
+    # last_query_time changes every turn; it is covered by the refresh interval instead
+    return encode_context({key: context[key] for key in sorted(context) if key != "last_query_time"})
+
+def _remember_persisted(session_id: str, fingerprint: Optional[str], updated_at: Optional[datetime] = None) -> None:
+    with _persisted_lock:
+        if fingerprint is None:
+            _persisted_contexts.pop(session_id, None)
+            return
+        _persisted_contexts[session_id] = (fingerprint, updated_at)
+        _persisted_contexts.move_to_end(session_id)
+        while len(_persisted_contexts) > SESSION_CONTEXT_MAX_ENTRIES:
+            _persisted_contexts.popitem(last=False)
+
+def _needs_persist(session_id: str, fingerprint: str, now: datetime) -> bool:
+    with _persisted_lock:
+        persisted = _persisted_contexts.get(session_id)
+    return (persisted is None or persisted[0] != fingerprint
+            or (now - persisted[1]).total_seconds() >= SESSION_CONTEXT_PERSIST_REFRESH_SECONDS)
+
+class SessionSnapshot:
+    """Session row and chat history loaded once and shared by every stage of a request."""
+
+    def __init__(self, session_id: str, client_id: str, last_order_id: Optional[str], messages: List):
+        self.session_id = session_id
+        self.client_id = client_id
+        self.last_order_id = last_order_id
+        self.messages = messages
+        self.extraction: Optional[TurnExtraction] = None
+        # Rolling summary of messages older than the recent window, if one has been written
+        self.summary: Optional[str] = None
+        # Number of leading messages already covered by the summary
+        self.summary_index = 0
+
+    def append_message(self, role: str, message: str) -> None:
+        self.messages.append(HumanMessage(content=message) if role == "user" else AIMessage(content=message))
+
+# Snapshot for the request currently being processed, if any
+_active_snapshot: ContextVar[Optional[SessionSnapshot]] = ContextVar("active_session_snapshot", default=None)
+
+# Session IDs per IN (...) query when loading snapshots in bulk
+SNAPSHOT_BATCH_SIZE = 500
+# Trailing messages loaded per session; history consumers only look at the last few turns. Keep it above
+# 2 * SUMMARY_EVERY_TURNS + SUMMARY_KEEP_MESSAGES so every message the summary does not cover is loaded
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "20"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 500
+# Recently active sessions whose persisted context is loaded at startup
+SESSION_CONTEXT_PRELOAD_LIMIT = int(os.getenv("SESSION_CONTEXT_PRELOAD_LIMIT", "5000"))
+
+def _message_window_query(count: int) -> str:
+    # One index-ordered LIMIT per session; works without window functions
+    arm = """
+        (SELECT chat_id, id, role, message, timestamp FROM chat_messages
+         WHERE chat_id = %s ORDER BY timestamp DESC, id DESC LIMIT %s)
+    """
+    return " UNION ALL ".join([arm] * count)
+
+def load_session_snapshots(session_ids: Iterable[str]) -> Dict[str, SessionSnapshot]:
+    """Load session rows and the last HISTORY_WINDOW messages of each session in grouped round trips.
+
+    Missing or deleted sessions are absent from the result.
+    """
+    session_ids = list(dict.fromkeys(session_ids))
+    snapshots: Dict[str, SessionSnapshot] = {}
+    if not session_ids:
+        return snapshots
+    
+    # Taken before the query: a message committed meanwhile is deduplicated by ID, not missed
+    unsaved = {session_id: message_writer.pending(session_id) for session_id in session_ids} if MESSAGE_WRITE_BEHIND else {}
+    
+    conn = get_db_connection()
+    if not conn:
+        logger.error("Database connection failed for session snapshot")
+        raise Exception("Database connection failed")
+    
+    try:
+        saved_ids = set()
+        # session_id -> (summary_until, summary_until_id), the last message the summary covers
+        until: Dict[str, Tuple[datetime, str]] = {}
+        for start in range(0, len(session_ids), SNAPSHOT_BATCH_SIZE):
+            chunk = session_ids[start:start + SNAPSHOT_BATCH_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            query = f"""
+                SELECT id AS session_id, client_id, last_order_id, context, context_updated_at,
+                       summary, summary_until, summary_until_id
+                FROM chat_sessions
+                WHERE id IN ({placeholders}) AND deleted = FALSE
+            """
+            for row in execute_query(conn, query, tuple(chunk), fetch=True) or []:
+                snapshot = SessionSnapshot(row["session_id"], row["client_id"], row["last_order_id"], [])
+                snapshot.summary = row["summary"]
+                if row["summary_until"] is not None:
+                    until[row["session_id"]] = (row["summary_until"], row["summary_until_id"])
+                snapshots[row["session_id"]] = snapshot
+                rehydrate_session_context(row["session_id"], row["context"], row["context_updated_at"])
+            
+            live = [session_id for session_id in chunk if session_id in snapshots]
+            if not live or HISTORY_WINDOW <= 0:
+                continue
+            params = tuple(value for session_id in live for value in (session_id, HISTORY_WINDOW))
+            windows: Dict[str, List[Dict[str, Any]]] = {}
+            for row in execute_query(conn, _message_window_query(len(live)), params, fetch=True) or []:
+                windows.setdefault(row["chat_id"], []).append(row)
+            for session_id, rows in windows.items():
+                snapshot = snapshots[session_id]
+                for row in reversed(rows):
+                    snapshot.append_message(row["role"], row["message"])
+                    saved_ids.add(row["id"])
+                    if until.get(session_id) and (row["timestamp"], row["id"]) <= until[session_id]:
+                        snapshot.summary_index = len(snapshot.messages)
+        for session_id, pending in unsaved.items():
+            snapshot = snapshots.get(session_id)
+            if snapshot is not None:
+                for message in pending:
+                    if message.message_id not in saved_ids:
+                        snapshot.append_message(message.role, message.message)
+        for session_id in session_ids:
+            snapshot = snapshots.get(session_id)
+            session_validity.put(session_id, snapshot.client_id if snapshot else None)
+        return snapshots
+    finally:
+        if conn:
+            conn.close()
+
+def rehydrate_session_context(session_id: str, data: Optional[str], updated_at: Optional[datetime]) -> None:
+    """Seed the context cache from a persisted context that is newer than the cached one.
+
+    Covers process restarts and, with per-process stores, turns handled by another worker.
+    Contexts idle for longer than the store TTL are not revived.
+    """
+    if not data or updated_at is None or (datetime.now() - updated_at).total_seconds() > SESSION_CONTEXT_TTL_SECONDS:
+        return
+    cached = session_context_cache.get(session_id)
+    if cached is not None and cached.get("last_query_time") and cached["last_query_time"] >= updated_at:
+        return
+    try:
+        context = decode_context(data)
+        session_context_cache[session_id] = context
+        _remember_persisted(session_id, _context_fingerprint(context), updated_at)
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable persisted context for session {session_id}: {e}")
+
+def preload_session_contexts(limit: int = SESSION_CONTEXT_PRELOAD_LIMIT) -> int:
+    """Load the persisted contexts of recently active sessions into the cache; returns how many."""
+    if limit <= 0:
+        return 0
+    conn = get_db_connection()
+    if not conn:
+        logger.error("Session context preload skipped: No database connection")
+        return 0
+    
+    try:
+        query = """
+            SELECT id, context, context_updated_at FROM chat_sessions
+            WHERE context_updated_at >= %s AND deleted = FALSE AND context IS NOT NULL
+            ORDER BY context_updated_at DESC LIMIT %s
+        """
+        since = datetime.now() - timedelta(seconds=SESSION_CONTEXT_TTL_SECONDS)
+        rows = execute_query(conn, query, (since, limit), fetch=True) or []
+        # Oldest first, so the most recent sessions are the last to be evicted
+        for row in reversed(rows):
+            rehydrate_session_context(row["id"], row["context"], row["context_updated_at"])
+        logger.info(f"Preloaded {len(rows)} session contexts")
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Session context preload failed: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def load_session_snapshot(session_id: str) -> Optional[SessionSnapshot]:
+    """Load the session row and its recent chat history; None if missing or deleted."""
+    return load_session_snapshots([session_id]).get(session_id)
+
+@contextmanager
+def session_scope(snapshot: SessionSnapshot) -> Iterator[SessionSnapshot]:
+    """Serve history and session-row reads for snapshot.session_id from the snapshot while active."""
+    token = _active_snapshot.set(snapshot)
+    try:
+        yield snapshot
+    finally:
+        _active_snapshot.reset(token)
+
+def get_session_snapshot(session_id: str) -> Optional[SessionSnapshot]:
+    """Return the active request snapshot for a session, if one is in scope."""
+    snapshot = _active_snapshot.get()
+    if snapshot is not None and snapshot.session_id == session_id:
+        return snapshot
+    return None
+
+def _turn_extraction_args(session_id: str, query: str, last_order_id: Optional[str]) -> Tuple:
+    # Copied on the calling thread; the context may change while a stage runs
+    context = session_context_cache.get(session_id, {})
+    return (query, sorted(context.get("order_ids", ())), context.get("last_intent"),
+            context.get("waiting_for"), last_order_id)
+
+def _extract_email(query: str) -> str:
+    return invoke_prompt("EMAIL_PROMPT", EMAIL_PROMPT, query=query).strip()
+
+def _extract_order_id(query: str, last_order_id: str) -> str:
+    return invoke_prompt("ORDER_ID_PROMPT", ORDER_ID_PROMPT, query=query, order_id=last_order_id).strip()
+
+def get_turn_extraction(session_id: str, query: str) -> Optional[TurnExtraction]:
+    """Return the combined extraction for this turn, running it at most once per request.
+
+    None when combined extraction is disabled, no request snapshot is active or the call
+    failed; callers then fall back to their single-field prompts.
+    """
+    if not COMBINED_EXTRACTION:
+        return None
+    snapshot = get_session_snapshot(session_id)
+    if snapshot is None:
+        return None
+    if snapshot.extraction is not None and snapshot.extraction.query == query:
+        return snapshot.extraction
+    
+    snapshot.extraction = stage_result(
+        "turn_extraction", query,
+        lambda: extract_turn(*_turn_extraction_args(session_id, query, snapshot.last_order_id)),
+        default=None
+    )
+    return snapshot.extraction
+
+def prefetch_turn_stages(session_id: str, query: str) -> None:
+    """Start this turn's extraction calls in the background so they overlap intent classification.
+
+    Only calls whose inputs are already known are started; consumers pick up a result only
+    when their inputs match, and compute inline otherwise.
+    """
+    snapshot = get_session_snapshot(session_id)
+    if snapshot is None:
+        return
+    if COMBINED_EXTRACTION:
+        start_stage("turn_extraction", query, extract_turn, *_turn_extraction_args(session_id, query, snapshot.last_order_id))
+        return
+    
+    if "@" in query:
+        start_stage("email", query, _extract_email, query)
+    last_order_id = snapshot.last_order_id or ""
+    if last_order_id or "ORD" in query.upper():
+        start_stage("order_id", (query, last_order_id), _extract_order_id, query, last_order_id)
 
 def create_session(client_id: str) -> str:
     """Create a new session."""
@@ -25,14 +287,22 @@ def create_session(client_id: str) -> str:
             VALUES (%s, %s, %s, %s)
         """
         execute_query(conn, query, (session_id, client_id, datetime.now(), False), fetch=False)
+        session_validity.put(session_id, client_id)
         logger.info(f"Created new session: {session_id} for client: {client_id}")
         return session_id
     finally:
-        if conn and conn.is_connected():
+        if conn:
             conn.close()
 
 def save_chat_message(session_id: str, role: str, message: str) -> bool:
-    """Save a chat message to the database."""
+    """Save a chat message to the database, or queue it when write-behind is enabled."""
+    if MESSAGE_WRITE_BEHIND:
+        saved = message_writer.submit(session_id, role, message)
+        snapshot = get_session_snapshot(session_id)
+        if saved and snapshot is not None:
+            snapshot.append_message(role, message)
+        return saved
+    
     conn = get_db_connection()
     if not conn:
         logger.error("Failed to save chat message: No database connection")
@@ -46,12 +316,15 @@ def save_chat_message(session_id: str, role: str, message: str) -> bool:
         """
         execute_query(conn, query, (message_id, session_id, role, message), fetch=False)
         logger.debug(f"Saved message for session {session_id}")
+        snapshot = get_session_snapshot(session_id)
+        if snapshot is not None:
+            snapshot.append_message(role, message)
         return True
     except Exception as e:
         logger.error(f"Error saving chat message: {e}")
         return False
     finally:
-        if conn and conn.is_connected():
+        if conn:
             conn.close()
 
 def mark_session_as_deleted(session_id: str) -> bool:
@@ -62,97 +335,171 @@ def mark_session_as_deleted(session_id: str) -> bool:
         return False
     
     try:
-        query = "UPDATE chat_sessions SET deleted = TRUE, last_order_id = NULL WHERE id = %s"
+        query = "UPDATE chat_sessions SET deleted = TRUE, last_order_id = NULL, context = NULL WHERE id = %s"
         execute_query(conn, query, (session_id,), fetch=False)
+        session_validity.invalidate(session_id)
         logger.info(f"Marked session {session_id} as deleted")
         
-        if session_id in session_context_cache:
-            del session_context_cache[session_id]
+        session_context_cache.pop(session_id, None)
+        _remember_persisted(session_id, None)
             
         return True
     except Exception as e:
         logger.error(f"Error marking session as deleted: {e}")
         return False
     finally:
-        if conn and conn.is_connected():
+        if conn:
             conn.close()
 
-def retrieve_chat_history(session_id: str) -> Dict[str, Any]:
-    """Retrieve chat history and context for a session."""
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed for chat history")
-        raise Exception("Database connection failed")
-    
+def retrieve_chat_history(session_id: str, limit: Optional[int] = None) -> Dict[str, Any]:
+    """Retrieve the recent chat history and context for a session.
+
+    At most the last HISTORY_WINDOW messages (plus those added during the request) are held;
+    limit trims that further. Use fetch_chat_page for older messages.
+    """
     try:
-        query = """
-            SELECT cm.role, cm.message, cm.timestamp, cs.client_id
-            FROM chat_messages cm
-            JOIN chat_sessions cs ON cm.chat_id = cs.id
-            WHERE cm.chat_id = %s AND cs.deleted = FALSE
-            ORDER BY cm.timestamp ASC
-        """
-        messages = execute_query(conn, query, (session_id,), fetch=True)
+        snapshot = get_session_snapshot(session_id)
+        if snapshot is None:
+            found, client_id = session_validity.lookup(session_id)
+            snapshot = load_session_snapshot(session_id) if not found or client_id else None
+            if snapshot is None:
+                logger.warning(f"Session not found: {session_id}")
+                raise Exception("Session not found or deleted")
         
-        if not messages and not execute_query(conn, 
-            "SELECT id FROM chat_sessions WHERE id = %s AND deleted = FALSE", 
-            (session_id,), fetch=True):
-            logger.warning(f"Session not found: {session_id}")
-            raise Exception("Session not found or deleted")
-        
-        formatted_messages = [
-            HumanMessage(content=msg["message"]) if msg["role"] == "user"
-            else AIMessage(content=msg["message"])
-            for msg in messages
-        ]
-        
-        if session_id not in session_context_cache:
-            session_context_cache[session_id] = {
-                "order_ids": set(),
-                "last_order_id": None,
-                "email": None,
-                "last_query_time": datetime.now(),
-                "last_intent": None
-            }
+        context = session_context_cache.setdefault(session_id, {
+            "order_ids": set(),
+            "last_order_id": None,
+            "email": None,
+            "last_query_time": datetime.now(),
+            "last_intent": None
+        })
         
         logger.info(f"Retrieved chat history for session {session_id}")
         return {
-            "messages": formatted_messages,
-            "order_ids": session_context_cache[session_id]["order_ids"],
-            "last_order_id": session_context_cache[session_id]["last_order_id"],
-            "email": session_context_cache[session_id]["email"],
-            "last_intent": session_context_cache[session_id]["last_intent"],
-            "client_id": messages[0]["client_id"] if messages else None
+            "messages": list(snapshot.messages[-limit:] if limit else snapshot.messages),
+            "summary": snapshot.summary,
+            "unsummarized_messages": list(snapshot.messages[snapshot.summary_index:]),
+            "order_ids": context["order_ids"],
+            "last_order_id": context["last_order_id"],
+            "email": context["email"],
+            "last_intent": context["last_intent"],
+            "waiting_for": context.get("waiting_for"),
+            "client_id": snapshot.client_id if snapshot.messages else None
         }
     except Exception as e:
         logger.error(f"Chat history retrieval error: {e}")
         raise
+
+def encode_history_cursor(timestamp: datetime, message_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{message_id}".encode()).decode()
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
+def fetch_chat_page(session_id: str, limit: int = HISTORY_PAGE_SIZE, before: Optional[str] = None) -> Dict[str, Any]:
+    """Return up to limit messages older than the before cursor (newest page when None), oldest first.
+
+    Pages are keyset-paginated on (timestamp, id); next_cursor fetches the page before this one
+    and is None once the start of the history is reached.
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    position = decode_history_cursor(before) if before else None
+    # Taken before the query, as in load_session_snapshots
+    unsaved = message_writer.pending(session_id) if MESSAGE_WRITE_BEHIND else []
+    
+    conn = get_db_connection()
+    if not conn:
+        logger.error("Database connection failed for chat history page")
+        raise Exception("Database connection failed")
+    
+    try:
+        found, client_id = session_validity.lookup(session_id)
+        if not found:
+            rows = execute_query(conn, "SELECT client_id FROM chat_sessions WHERE id = %s AND deleted = FALSE", (session_id,), fetch=True)
+            client_id = rows[0]["client_id"] if rows else None
+            session_validity.put(session_id, client_id)
+        if client_id is None:
+            logger.warning(f"Session not found: {session_id}")
+            raise Exception("Session not found or deleted")
+        
+        if position is None:
+            query = """
+                SELECT id, role, message, timestamp FROM chat_messages
+                WHERE chat_id = %s
+                ORDER BY timestamp DESC, id DESC LIMIT %s
+            """
+            params = (session_id, limit + 1)
+        else:
+            query = """
+                SELECT id, role, message, timestamp FROM chat_messages
+                WHERE chat_id = %s AND (timestamp < %s OR (timestamp = %s AND id < %s))
+                ORDER BY timestamp DESC, id DESC LIMIT %s
+            """
+            params = (session_id, position[0], position[0], position[1], limit + 1)
+        rows = [(row["timestamp"], row["id"], row["role"], row["message"])
+                for row in execute_query(conn, query, params, fetch=True) or []]
     finally:
-        if conn and conn.is_connected():
-            conn.close()
+        conn.close()
+    
+    saved_ids = {row[1] for row in rows}
+    for message in unsaved:
+        key = (message.timestamp, message.message_id)
+        if message.message_id not in saved_ids and (position is None or key < position):
+            rows.append((message.timestamp, message.message_id, message.role, message.message))
+    rows.sort(key=lambda row: (row[0], row[1]), reverse=True)
+    
+    page = rows[:limit]
+    next_cursor = encode_history_cursor(page[-1][0], page[-1][1]) if len(rows) > limit else None
+    return {
+        "messages": [
+            {"role": "user" if role == "user" else "assistant", "content": message, "timestamp": timestamp.isoformat()}
+            for timestamp, _, role, message in reversed(page)
+        ],
+        "next_cursor": next_cursor
+    }
 
 def format_chat_history_and_extract_order_id(session_id: str, query: str) -> Tuple[str, str]:
     """Format chat history and extract order ID using LLM."""
     try:
         context = retrieve_chat_history(session_id)
-        messages = context["messages"]
+        if SUMMARY_ENABLED or context["summary"]:
+            # Every message the summary does not cover; the summarizer bounds these by 2K+N
+            messages = context["unsummarized_messages"]
+        else:
+            messages = context["messages"][-SUMMARY_KEEP_MESSAGES:]
         formatted_history = ""
-        for msg in messages[-5:]:
+        if context["summary"]:
+            formatted_history += f"Summary of earlier conversation: {context['summary']}\n"
+        for msg in messages:
             role = "Human" if isinstance(msg, HumanMessage) else "AI"
             formatted_history += f"{role}: {msg.content}\n"
         last_order_id = ""
-        with get_db_connection() as conn:
-            sql_query = """
-                SELECT last_order_id FROM chat_sessions WHERE id = %s;
-            """
-            print(f"{conn}, {sql_query}, {(session_id,)}")
-            result = execute_query(conn, sql_query, (session_id,), fetch=True)
-            print(f"EXE : {result}")
-            if result:
-                last_order_id = result[0]['last_order_id'] or ""
-        final_prompt = ORDER_ID_PROMPT.format(query=query, order_id=last_order_id)
-        response = llm.invoke(final_prompt)
-        order_id = response.content.strip()
+        snapshot = get_session_snapshot(session_id)
+        if snapshot is not None:
+            last_order_id = snapshot.last_order_id or ""
+        else:
+            with get_db_connection() as conn:
+                sql_query = """
+                    SELECT last_order_id FROM chat_sessions WHERE id = %s;
+                """
+                print(f"{conn}, {sql_query}, {(session_id,)}")
+                result = execute_query(conn, sql_query, (session_id,), fetch=True)
+                print(f"EXE : {result}")
+                if result:
+                    last_order_id = result[0]['last_order_id'] or ""
+        extraction = get_turn_extraction(session_id, query)
+        if extraction is not None:
+            order_id = extraction.order_id
+        else:
+            order_id = stage_result(
+                "order_id", (query, last_order_id),
+                lambda: _extract_order_id(query, last_order_id),
+                default=""
+            )
         return formatted_history, order_id if order_id.startswith("ORD") else ""
     except Exception as e:
         logger.error(f"Error formatting history or extracting order ID: {e}")
@@ -160,17 +507,14 @@ def format_chat_history_and_extract_order_id(session_id: str, query: str) -> Tup
 
 def update_session_context(session_id: str, intent: str, query: str, order_id: Optional[str] = None, email: Optional[str] = None, waiting_for: Optional[str] = None) -> None:
     """Update the session context."""
-    if session_id not in session_context_cache:
-        session_context_cache[session_id] = {
-            "order_ids": set(),
-            "last_order_id": None,
-            "email": None,
-            "last_query_time": datetime.now(),
-            "last_intent": None,
-            "waiting_for": None
-        }
-    
-    context = session_context_cache[session_id]
+    context = session_context_cache.setdefault(session_id, {
+        "order_ids": set(),
+        "last_order_id": None,
+        "email": None,
+        "last_query_time": datetime.now(),
+        "last_intent": None,
+        "waiting_for": None
+    })
     
     if order_id:
         context["order_ids"].add(order_id)
@@ -178,38 +522,41 @@ def update_session_context(session_id: str, intent: str, query: str, order_id: O
     
     if email:
         context["email"] = email
-    else:
-        final_prompt = EMAIL_PROMPT.format(query=query)
-        response = llm.invoke(final_prompt)
-        email = response.content.strip()
+    elif "@" in query:
+        extraction = get_turn_extraction(session_id, query)
+        if extraction is not None:
+            email = extraction.email
+        else:
+            email = stage_result("email", query, lambda: _extract_email(query), default="")
         if email and "@" in email:
             context["email"] = email
     
     context["last_query_time"] = datetime.now()
     context["last_intent"] = intent
     context["waiting_for"] = waiting_for
+    # Re-store so the context store re-measures the entry after the in-place changes
+    session_context_cache[session_id] = context
+    snapshot = get_session_snapshot(session_id)
+    if snapshot is not None and context["last_order_id"]:
+        snapshot.last_order_id = context["last_order_id"]
     
-    if context["last_order_id"]:
-        conn = get_db_connection()
-        if conn:
-            try:
-                query = "UPDATE chat_sessions SET last_order_id = %s WHERE id = %s"
-                execute_query(conn, query, (context["last_order_id"], session_id), fetch=False)
-                logger.debug(f"Updated last_order_id to {context['last_order_id']} for session {session_id}")
-            except Exception as e:
-                logger.error(f"Error updating last_order_id: {e}")
-            finally:
-                if conn and conn.is_connected():
-                    conn.close()
-
-def clean_old_contexts() -> None:
-    """Clean up old session contexts."""
-    now = datetime.now()
-    expired_sessions = [
-        session_id for session_id, context in session_context_cache.items()
-        if now - context["last_query_time"] > timedelta(hours=2)
-    ]
-    
-    for session_id in expired_sessions:
-        del session_context_cache[session_id]
-        logger.debug(f"Cleaned expired session context: {session_id}")
\ No newline at end of file
+    # Persisted with last_order_id in one statement so a restart or another worker can pick it up,
+    # but only when it has changed since it was last written (last_order_id is part of the context)
+    fingerprint = _context_fingerprint(context)
+    if not _needs_persist(session_id, fingerprint, context["last_query_time"]):
+        return
+    conn = get_db_connection()
+    if conn:
+        try:
+            query = """
+                UPDATE chat_sessions
+                SET last_order_id = COALESCE(%s, last_order_id), context = %s, context_updated_at = %s
+                WHERE id = %s
+            """
+            execute_query(conn, query, (context["last_order_id"], encode_context(context), context["last_query_time"], session_id), fetch=False)
+            _remember_persisted(session_id, fingerprint, context["last_query_time"])
+            logger.debug(f"Persisted context for session {session_id}")
+        except Exception as e:
+            logger.error(f"Error persisting session context: {e}")
+        finally:
+            conn.close()
@@ -0,0 +1,120 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Set
+from ..database.db_utils import get_db_connection, execute_query
+from ..genai.response_cache import invoke_prompt
+from ..genai.prompt_templates import SUMMARY_PROMPT
+
+logger = logging.getLogger(__name__)
+
+# When enabled, older messages are folded into chat_sessions.summary in the background
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "false").lower() == "true"
+# A turn is a user message and its reply; the summary advances once this many turns are unsummarised
+SUMMARY_EVERY_TURNS = int(os.getenv("SUMMARY_EVERY_TURNS", "5"))
+# Most recent messages always left out of the summary; prompts get every unsummarised message verbatim
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "5"))
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+# Upper bound on messages folded in one update, e.g. for sessions that predate summaries
+SUMMARY_MAX_FOLD = 200
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_MAX_WORKERS, thread_name_prefix="summary")
+_in_flight: Set[str] = set()
+_in_flight_lock = threading.Lock()
+
+def _format_messages(rows) -> str:
+    return "\n".join(f"{'Human' if row['role'] == 'user' else 'AI'}: {row['message']}" for row in rows)
+
+def update_summary(session_id: str) -> bool:
+    """Fold messages that have dropped out of the recent window into the session summary.
+
+    Does nothing until SUMMARY_EVERY_TURNS turns are unsummarised. The write is conditional on
+    the summary position it started from, so concurrent updaters cannot fold messages twice.
+    Returns True if the summary was advanced.
+    """
+    conn = get_db_connection()
+    if not conn:
+        logger.error("Summary update skipped: No database connection")
+        return False
+
+    try:
+        rows = execute_query(
+            conn,
+            "SELECT summary, summary_until, summary_until_id FROM chat_sessions WHERE id = %s AND deleted = FALSE",
+            (session_id,), fetch=True
+        )
+        if not rows:
+            return False
+        summary, until, until_id = rows[0]["summary"], rows[0]["summary_until"], rows[0]["summary_until_id"]
+
+        limit = SUMMARY_MAX_FOLD + SUMMARY_KEEP_MESSAGES
+        if until is None:
+            query = """
+                SELECT id, role, message, timestamp FROM chat_messages
+                WHERE chat_id = %s
+                ORDER BY timestamp ASC, id ASC LIMIT %s
+            """
+            params = (session_id, limit)
+        else:
+            query = """
+                SELECT id, role, message, timestamp FROM chat_messages
+                WHERE chat_id = %s AND (timestamp > %s OR (timestamp = %s AND id > %s))
+                ORDER BY timestamp ASC, id ASC LIMIT %s
+            """
+            params = (session_id, until, until, until_id, limit)
+        messages = execute_query(conn, query, params, fetch=True) or []
+    finally:
+        conn.close()
+
+    if len(messages) < 2 * SUMMARY_EVERY_TURNS + SUMMARY_KEEP_MESSAGES:
+        return False
+    fold = messages[:len(messages) - SUMMARY_KEEP_MESSAGES]
+
+    new_summary = invoke_prompt(
+        "SUMMARY_PROMPT", SUMMARY_PROMPT,
+        summary=summary or "None",
+        messages=_format_messages(fold)
+    ).strip()
+    if not new_summary:
+        return False
+
+    conn = get_db_connection()
+    if not conn:
+        logger.error("Summary update failed: No database connection")
+        return False
+    try:
+        cursor = execute_query(
+            conn,
+            """
+                UPDATE chat_sessions SET summary = %s, summary_until = %s, summary_until_id = %s
+                WHERE id = %s AND summary_until <=> %s AND summary_until_id <=> %s
+            """,
+            (new_summary, fold[-1]["timestamp"], fold[-1]["id"], session_id, until, until_id),
+            fetch=False
+        )
+        updated = cursor.rowcount > 0
+        if updated:
+            logger.debug(f"Folded {len(fold)} messages into the summary for session {session_id}")
+        return updated
+    finally:
+        conn.close()
+
+def _run_update(session_id: str) -> None:
+    try:
+        update_summary(session_id)
+    except Exception as e:
+        logger.error(f"Summary update failed for session {session_id}: {e}")
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(session_id)
+
+def schedule_summary_update(session_id: str) -> None:
+    """Queue a background summary check for a session after a turn; at most one per session at a time."""
+    if not SUMMARY_ENABLED:
+        return
+    with _in_flight_lock:
+        if session_id in _in_flight:
+            return
+        _in_flight.add(session_id)
+    _executor.submit(_run_update, session_id)
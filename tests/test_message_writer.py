@@ -0,0 +1,23 @@
+import json
+from mysql.connector import errors as mysql_errors
+from services.session import message_writer as writer_module
+from services.session.message_writer import MessageWriter
+
+def test_close_during_outage_dead_letters_unsaved_messages(tmp_path, monkeypatch):
+    dead_letter_path = tmp_path / "dead_letter.jsonl"
+    monkeypatch.setattr(writer_module, "MESSAGE_WRITER_DEAD_LETTER_PATH", str(dead_letter_path))
+
+    def insert_messages(messages):
+        raise mysql_errors.InterfaceError("Lost connection to MySQL server")
+    monkeypatch.setattr(writer_module, "insert_messages", insert_messages)
+
+    writer = MessageWriter(flush_interval=0.01)
+    for i in range(5):
+        assert writer.submit("session-1", "user", f"message {i}")
+    writer.close(timeout=0.5)
+
+    assert writer.pending("session-1") == []
+    records = [json.loads(line) for line in dead_letter_path.read_text().splitlines()]
+    assert [r["message"] for r in records] == [f"message {i}" for i in range(5)]
+    assert all(r["session_id"] == "session-1" for r in records)
+    assert writer.stats()["dead_lettered"] == 5